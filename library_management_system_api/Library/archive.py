@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedTransaction, Transactions
+
+ARCHIVE_FIELDS = ('id', 'user_id', 'book_id', 'checkout_date', 'return_date', 'due_date', 'penalty')
+
+
+def archive_cutoff(today=None, days=None):
+    """Loans returned before this date are archived."""
+    today = today or timezone.now().date()
+    if days is None:
+        days = getattr(settings, 'LIBRARY_ARCHIVE_AFTER_DAYS', 365)
+    return today - timedelta(days=days)
+
+
+def archive_loans(before, batch_size=5000, pause=0, max_batches=None, on_batch=None):
+    """
+    Move loans returned before ``before`` from Transactions into
+    ArchivedTransaction, ``batch_size`` at a time in id order.
+
+    Each batch is copied and deleted in one transaction, so an interrupted
+    run leaves every loan in exactly one of the tables and simply rerunning
+    picks up where it stopped. A loan whose id is already archived can only
+    mean the two rows disagree, so the insert raises IntegrityError and the
+    batch is rolled back rather than the live row deleted. ``pause`` seconds are slept between batches
+    to cap the write rate; ``on_batch(moved)`` is called after each one.
+    Returns the number of loans moved.
+    """
+    candidates = Transactions.objects.filter(return_date__lt=before).order_by('id')
+    moved, last, batches = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            rows = list(candidates.filter(id__gt=last).select_for_update().values(*ARCHIVE_FIELDS)[:batch_size])
+            if not rows:
+                break
+            ids = [row['id'] for row in rows]
+            ArchivedTransaction.objects.bulk_create([ArchivedTransaction(**row) for row in rows])
+            Transactions.objects.filter(id__in=ids).delete()
+        moved, last, batches = moved + len(rows), ids[-1], batches + 1
+        if on_batch is not None:
+            on_batch(moved)
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
@@ -0,0 +1,134 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+# Claims copied from the User row into every access token, and the time they
+# were read. ClaimsJWTAuthentication rebuilds a user from these on safe requests.
+CLAIM_FIELDS = ('email', 'username', 'is_admin')
+CLAIMS_AT = 'claims_at'
+USER_CACHE_KEY = 'library:jwt:user:{}'
+# What the user cache holds: enough to authenticate and authorize a request.
+# The password hash and group/permission rows stay in the database.
+USER_CACHE_FIELDS = ('is_active', 'is_admin', 'is_superuser', 'email', 'username')
+SESSION_HASH = 'session_auth_hash'
+
+
+def stamp_claims(token, user):
+    for field in CLAIM_FIELDS:
+        token[field] = getattr(user, field)
+    token[CLAIMS_AT] = int(time.time())
+    return token
+
+
+def _cache():
+    return caches[getattr(settings, 'LIBRARY_JWT_USER_CACHE', 'default')]
+
+
+def _from_values(values):
+    # from_db wants the loaded values in concrete-field order; the rest are deferred.
+    fields = [f.attname for f in User._meta.concrete_fields if f.attname in values]
+    return User.from_db(DEFAULT_DB_ALIAS, fields, [values[name] for name in fields])
+
+
+def load_user(user_id):
+    """
+    Fetch a user, through the short-TTL user cache when it is enabled.
+
+    The cache holds only the id, USER_CACHE_FIELDS and the session auth hash
+    (an HMAC of the password hash, which session checks compare against).
+    A cached user is rebuilt with every other field deferred. Saving or
+    deleting a User drops its entry, so deactivation and password changes
+    apply on the next request.
+    """
+    ttl = getattr(settings, 'LIBRARY_JWT_USER_CACHE_TTL', 0)
+    key = USER_CACHE_KEY.format(user_id)
+    if ttl:
+        entry = _cache().get(key)
+        if entry is not None:
+            user = _from_values({api_settings.USER_ID_FIELD: user_id, **entry})
+            user._session_auth_hash = entry[SESSION_HASH]
+            return user
+    user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+    if ttl and user is not None:
+        entry = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+        entry[SESSION_HASH] = user.get_session_auth_hash()
+        _cache().set(key, entry, ttl)
+    return user
+
+
+def forget_user(user_id):
+    _cache().delete(USER_CACHE_KEY.format(user_id))
+
+
+def claims_user(validated_token):
+    """
+    A User instance built from token claims without touching the database.
+
+    Only id and the claim fields are loaded; any other field is deferred, so
+    reading it (or anything else that needs the row) fetches it on demand.
+    """
+    return _from_values({
+        api_settings.USER_ID_FIELD: validated_token[api_settings.USER_ID_CLAIM],
+        'is_active': True,
+        **{field: validated_token[field] for field in CLAIM_FIELDS},
+    })
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that skips the per-request user SELECT where it can.
+
+    Safe (read-only) requests get a user built from the token's claims, as
+    long as the claims are younger than LIBRARY_JWT_CLAIMS_MAX_AGE seconds.
+    Other requests, and tokens with older or missing claims, load the real
+    row, cached for LIBRARY_JWT_USER_CACHE_TTL seconds. A deactivated or
+    demoted user is therefore seen within the larger of the two settings;
+    saving or deleting a User clears its cache entry straight away.
+    """
+
+    def authenticate(self, request):
+        self.safe_request = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def claims_are_fresh(self, validated_token):
+        if any(field not in validated_token for field in (*CLAIM_FIELDS, CLAIMS_AT)):
+            return False
+        max_age = getattr(settings, 'LIBRARY_JWT_CLAIMS_MAX_AGE', 0)
+        return time.time() - validated_token[CLAIMS_AT] <= max_age
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if getattr(self, 'safe_request', False) and self.claims_are_fresh(validated_token):
+            return claims_user(validated_token)
+
+        user = load_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose per-request session user lookup goes through the same
+    short-TTL user cache as ClaimsJWTAuthentication, so an HTML page with a
+    cached session needs no query to know who is asking.
+    """
+
+    def get_user(self, user_id):
+        user = load_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import Book
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+
+
+class Subscription:
+    """
+    One stream's interest in a set of books. Events are coalesced per book,
+    so a slow client only ever has the latest availability of each book
+    waiting for it, never an unbounded queue.
+    """
+
+    def __init__(self, book_ids, loop):
+        self.book_ids = frozenset(book_ids)
+        self.loop = loop
+        self.pending = {}
+        self.ready = asyncio.Event()
+
+    def deliver(self, event):
+        # Runs on the subscriber's event loop.
+        self.pending[event['book']] = event
+        self.ready.set()
+
+    async def next_events(self, timeout):
+        """Wait up to ``timeout`` seconds; returns the pending events, if any."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.ready.clear()
+        events, self.pending = list(self.pending.values()), {}
+        return events
+
+
+class InProcessBroker:
+    """
+    Fans availability events out to the streams open in this process.
+
+    Enough when one process both handles checkouts and serves the streams.
+    With several workers use CacheBroker, so a return handled by one worker
+    reaches streams held open by another.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscriptions = defaultdict(set)
+
+    def subscribe(self, book_ids):
+        subscription = Subscription(book_ids, asyncio.get_running_loop())
+        with self.lock:
+            for book_id in subscription.book_ids:
+                self.subscriptions[book_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for book_id in subscription.book_ids:
+                subscribers = self.subscriptions.get(book_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.subscriptions[book_id]
+
+    def wants(self, book_ids):
+        """The subset of ``book_ids`` that someone may be listening to."""
+        with self.lock:
+            return [book_id for book_id in book_ids if book_id in self.subscriptions]
+
+    def publish(self, events):
+        self.fan_out(events)
+
+    def fan_out(self, events):
+        for event in events:
+            with self.lock:
+                subscribers = list(self.subscriptions.get(event['book'], ()))
+            for subscription in subscribers:
+                try:
+                    subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+                except RuntimeError:
+                    # The stream's event loop is gone.
+                    self.unsubscribe(subscription)
+
+
+class CacheBroker(InProcessBroker):
+    """
+    Shares events between worker processes through the cache named by
+    LIBRARY_AVAILABILITY_CACHE, which must be shared (Redis, Memcached).
+
+    Publishing appends to a short-lived numbered log in the cache. Each
+    process that has open streams runs one thread that reads new entries
+    every LIBRARY_AVAILABILITY_POLL_INTERVAL seconds and fans them out
+    locally, so the cache sees one reader per worker, not one per client.
+    """
+    seq_key = 'library:availability:seq'
+    event_key = 'library:availability:event:{}'
+    event_ttl = 60
+
+    def __init__(self):
+        super().__init__()
+        self.poller = None
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'LIBRARY_AVAILABILITY_CACHE', 'default')]
+
+    def wants(self, book_ids):
+        # Streams in other processes are invisible from here.
+        return list(book_ids)
+
+    def subscribe(self, book_ids):
+        subscription = super().subscribe(book_ids)
+        with self.lock:
+            if self.poller is None or not self.poller.is_alive():
+                self.poller = threading.Thread(target=self.poll, name='availability-poller', daemon=True)
+                self.poller.start()
+        return subscription
+
+    def publish(self, events):
+        if not events:
+            return
+        self.cache.add(self.seq_key, 0, None)
+        last = self.cache.incr(self.seq_key, len(events))
+        first = last - len(events) + 1
+        self.cache.set_many(
+            {self.event_key.format(seq): event for seq, event in zip(range(first, last + 1), events)},
+            self.event_ttl,
+        )
+
+    def poll(self):
+        interval = getattr(settings, 'LIBRARY_AVAILABILITY_POLL_INTERVAL', 0.5)
+        last = self.cache.get(self.seq_key, 0)
+        waiting_since = None
+        while True:
+            with self.lock:
+                if not self.subscriptions:
+                    self.poller = None
+                    return
+            time.sleep(interval)
+            try:
+                current = self.cache.get(self.seq_key, 0)
+                if current < last:
+                    last = current  # the cache was flushed
+                seqs = range(max(last + 1, current - 999), current + 1)
+                found = self.cache.get_many([self.event_key.format(seq) for seq in seqs])
+                events = []
+                for seq in seqs:
+                    event = found.get(self.event_key.format(seq))
+                    if event is None and (waiting_since is None or time.monotonic() - waiting_since < 2 * interval):
+                        # Numbered but not written yet; give the publisher a moment.
+                        waiting_since = waiting_since or time.monotonic()
+                        break
+                    waiting_since = None
+                    if event is not None:
+                        events.append(event)
+                    last = seq
+                self.fan_out(events)
+            except Exception:
+                logger.exception('Availability poller failed')
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    path = getattr(settings, 'LIBRARY_AVAILABILITY_BROKER', 'Library.availability.InProcessBroker')
+    return import_string(path)()
+
+
+def publish_availability(book_ids):
+    """Publish the current copy counts of ``book_ids`` to their streams."""
+    book_ids = get_broker().wants(set(book_ids))
+    if not book_ids:
+        return
+    events = [
+        {'book': book_id, 'available': available}
+        for book_id, available in Book.objects.filter(id__in=book_ids).values_list('id', 'Number_of_copies_Available')
+    ]
+    get_broker().publish(events)
+
+
+def notify_availability(book_ids):
+    """
+    Call from inside the transaction that changes copy counts; the event is
+    published once it commits, and a broker failure never fails the request.
+    """
+    book_ids = list(book_ids)
+    transaction.on_commit(lambda: publish_availability(book_ids), robust=True)
+
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+async def availability_events(book_ids, keepalive=KEEPALIVE_SECONDS):
+    """
+    Server-sent events for ``book_ids``: the current availability of each,
+    then one event per change, with a comment line as keepalive.
+    """
+    broker = get_broker()
+    # Subscribe before reading the snapshot, so no change can fall between.
+    subscription = broker.subscribe(book_ids)
+    try:
+        yield 'retry: 3000\n\n'
+        async for book_id, available in Book.objects.filter(id__in=book_ids).values_list('id', 'Number_of_copies_Available'):
+            yield sse('availability', {'book': book_id, 'available': available})
+        while True:
+            events = await subscription.next_events(keepalive)
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield sse('availability', event)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,183 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.encoding import iri_to_uri
+from rest_framework import status
+from rest_framework.response import Response
+
+from .replicas import read_from_replica, use_primary
+
+CATALOG_VERSION_KEY = 'library:catalog:version'
+BOOK_VERSION_KEY = 'library:book:{}:version'
+STATS_KEY = 'library:catalog:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'LIBRARY_CATALOG_CACHE', 'default')]
+
+
+def _version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock rather than 1, so a version key that was evicted
+        # can never come back as a value that older entries were stored under.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def bump_catalog_version(book_ids=()):
+    """
+    Invalidate cached catalog responses: every list page, and the detail
+    pages of ``book_ids``. Other books' detail pages stay cached.
+    """
+    _bump(CATALOG_VERSION_KEY)
+    for book_id in book_ids:
+        _bump(BOOK_VERSION_KEY.format(book_id))
+
+
+def invalidate_catalog(book_ids=()):
+    """
+    Call from inside the transaction that changes the catalog. Bumping now
+    keeps reads later in the same transaction fresh; bumping again on commit
+    discards anything a concurrent request cached from the old rows meanwhile.
+    """
+    book_ids = list(book_ids)
+    bump_catalog_version(book_ids)
+    transaction.on_commit(lambda: bump_catalog_version(book_ids))
+
+
+def catalog_version():
+    """The current catalog version, for keying caches of catalog-wide data."""
+    return _version(CATALOG_VERSION_KEY)
+
+
+def catalog_count(queryset, label):
+    """
+    ``queryset.count()``, cached until the catalog next changes. ``label``
+    must identify the queryset's filters.
+    """
+    digest = hashlib.md5(label.encode(), usedforsecurity=False).hexdigest()
+    key = f'library:catalog:count:{catalog_version()}:{digest}'
+    timeout = getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300)
+    return get_cache().get_or_set(key, queryset.count, timeout)
+
+
+def _count(outcome, amount=1):
+    cache = get_cache()
+    key = STATS_KEY.format(outcome)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, amount)
+
+
+def catalog_cache_stats():
+    cache = get_cache()
+    hits = cache.get(STATS_KEY.format('hits'), 0)
+    misses = cache.get(STATS_KEY.format('misses'), 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else 0.0}
+
+
+class CachedCatalogMixin:
+    """
+    Cache BookView list and retrieve responses.
+
+    List pages are keyed on the full URL (path and query parameters) plus the
+    catalog version; detail pages on the URL plus that book's version. Book
+    saves and deletes and every checkout or return bump the versions, so
+    stale entries are simply never read again and expire on their own.
+    Misses are filled from the primary, never a replica: rows read from a
+    replica that hasn't caught up with a write would be stored under the
+    version that write just bumped.
+
+    Only list pages whose query parameters are all in
+    ``catalog_cached_params`` are cached. Searches, filters and later pages
+    rarely repeat, so they are read from a replica and not stored.
+    """
+    catalog_cache_timeout = None
+    catalog_cached_params = frozenset({'ordering', 'format'})
+
+    def get_catalog_cache_timeout(self):
+        if self.catalog_cache_timeout is not None:
+            return self.catalog_cache_timeout
+        return getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300)
+
+    def catalog_cache_key(self, request, version, url=None):
+        url = iri_to_uri(url or request.build_absolute_uri())
+        return f'library:catalog:response:{version}:{hashlib.md5(url.encode(), usedforsecurity=False).hexdigest()}'
+
+    def cached_response(self, request, version_key, build):
+        version = _version(version_key)
+        key = self.catalog_cache_key(request, version)
+        cache = get_cache()
+        data = cache.get(key)
+        if data is not None:
+            _count('hits')
+            return Response(data, status=status.HTTP_200_OK)
+        _count('misses')
+        with use_primary():
+            response = build()
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, self.get_catalog_cache_timeout())
+        return response
+
+    def cached_books(self, request, book_ids, load):
+        """
+        {id: serialized book} for ``book_ids``, sharing the detail pages'
+        cache entries. Cached books are read with two get_many calls whatever
+        their number; ``load(missing_ids)`` must return the rest as
+        {id: serialized book}, and they are cached for later detail and batch
+        requests. Books that don't exist are left out.
+        """
+        cache = get_cache()
+        version_keys = {book_id: BOOK_VERSION_KEY.format(book_id) for book_id in book_ids}
+        versions = cache.get_many(list(version_keys.values()))
+        keys = {
+            book_id: self.catalog_cache_key(
+                request,
+                versions.get(version_key) or _version(version_key),
+                self.reverse_action('detail', args=[book_id]),
+            )
+            for book_id, version_key in version_keys.items()
+        }
+        found = cache.get_many(list(keys.values()))
+        books = {book_id: found[key] for book_id, key in keys.items() if key in found}
+        missing = [book_id for book_id in book_ids if book_id not in books]
+        if books:
+            _count('hits', len(books))
+        if missing:
+            _count('misses', len(missing))
+            with use_primary():
+                loaded = load(missing)
+            cache.set_many({keys[book_id]: data for book_id, data in loaded.items()}, self.get_catalog_cache_timeout())
+            books.update(loaded)
+        return books
+
+    def list(self, request, *args, **kwargs):
+        def build(request=request):
+            return super(CachedCatalogMixin, self).list(request, *args, **kwargs)
+        if set(request.query_params) - self.catalog_cached_params:
+            return read_from_replica(build)(request)
+        return self.cached_response(request, CATALOG_VERSION_KEY, build)
+
+    def retrieve(self, request, *args, **kwargs):
+        book_id = kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if str(book_id).isdigit():
+            book_id = int(book_id)
+        version_key = BOOK_VERSION_KEY.format(book_id)
+        return self.cached_response(request, version_key, lambda: super(CachedCatalogMixin, self).retrieve(request, *args, **kwargs))
@@ -0,0 +1,132 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import connection, transaction
+
+from .catalog_cache import bump_catalog_version
+from .models import Book
+from .search import get_search_backend
+
+# Accepted column names (compared case-insensitively) for each Book field.
+COLUMNS = {
+    'title': 'Title',
+    'author': 'Author',
+    'isbn': 'ISBN',
+    'number_of_copies_available': 'Number_of_copies_Available',
+    'copies': 'Number_of_copies_Available',
+}
+REQUIRED = ('Title', 'Author', 'ISBN', 'Number_of_copies_Available')
+MAX_LENGTHS = {name: Book._meta.get_field(name).max_length for name in ('Title', 'Author', 'ISBN')}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def read_records(stream, fmt):
+    """
+    Yield the records of a CSV (with a header row) or JSON Lines stream as
+    dicts, one at a time. A JSONL line that does not parse is yielded as
+    the RowError it raised, so it is rejected without stopping the import.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield RowError(f'invalid JSON: {e}')
+            continue
+        yield record if isinstance(record, dict) else RowError('not a JSON object')
+
+
+def clean_record(record):
+    """
+    Turn one raw record into Book field values, or raise RowError.
+
+    This is the subset of BookSerializer's validation an import needs,
+    without building a serializer per row.
+    """
+    if isinstance(record, RowError):
+        raise record
+    values = {}
+    for key, value in record.items():
+        field = COLUMNS.get(str(key).strip().lower())
+        if field is not None:
+            values[field] = value.strip() if isinstance(value, str) else value
+    missing = [name for name in REQUIRED if values.get(name) in (None, '')]
+    if missing:
+        raise RowError(f'missing {", ".join(missing)}')
+    for name, limit in MAX_LENGTHS.items():
+        values[name] = str(values[name])
+        if len(values[name]) > limit:
+            raise RowError(f'{name} is longer than {limit} characters')
+    try:
+        copies = int(values['Number_of_copies_Available'])
+    except (TypeError, ValueError):
+        raise RowError('Number_of_copies_Available is not a whole number')
+    if copies < 0:
+        raise RowError('Number_of_copies_Available is negative')
+    values['Number_of_copies_Available'] = copies
+    return values
+
+
+def upsert_books(rows, update_fields):
+    """
+    Insert ``rows`` (cleaned field dicts) in one statement, updating
+    ``update_fields`` on books whose ISBN already exists. Bulk inserts send no
+    post_save signals, so the catalog cache and search index are updated
+    here: each book's cache version is bumped once, when the batch commits
+    (nothing reads the catalog later in the import's transaction).
+    """
+    # A repeated ISBN within one statement is an error on some databases.
+    by_isbn = {row['ISBN']: row for row in rows}
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = ['ISBN']
+    with transaction.atomic():
+        Book.objects.bulk_create([Book(**row) for row in by_isbn.values()], **options)
+        book_ids = list(Book.objects.filter(ISBN__in=by_isbn).values_list('id', flat=True))
+        transaction.on_commit(lambda: bump_catalog_version(book_ids))
+    get_search_backend().index_many(book_ids)
+    return len(by_isbn)
+
+
+def import_books(records, batch_size=1000, skip=0, update_fields=('Title', 'Author'), on_batch=None):
+    """
+    Clean and upsert an iterable of raw records in batches, each batch in
+    its own transaction.
+
+    The first ``skip`` records are passed over, which is how an interrupted
+    import resumes. After each committed batch ``on_batch(position,
+    imported, rejected)`` is called, where ``position`` is the number of
+    records consumed so far and ``rejected`` is a list of ``(position,
+    reason)`` for that batch. Returns the total ``(imported, rejected)``.
+    """
+    position = skip
+    records = islice(records, skip, None)
+    imported = rejected = 0
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            return imported, rejected
+        rows, errors = [], []
+        for offset, record in enumerate(chunk, start=position + 1):
+            try:
+                rows.append(clean_record(record))
+            except RowError as e:
+                errors.append((offset, str(e)))
+        batch_imported = upsert_books(rows, list(update_fields)) if rows else 0
+        position += len(chunk)
+        imported += batch_imported
+        rejected += len(errors)
+        if on_batch is not None:
+            on_batch(position, batch_imported, errors)
@@ -0,0 +1,119 @@
+import csv
+import json
+from itertools import chain
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+EXPORT_CHUNK_SIZE = 5000
+
+LOAN_COLUMNS = (
+    ('id', 'id'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+    ('email', 'user__email'),
+    ('book_id', 'book_id'),
+    ('isbn', 'book__ISBN'),
+    ('title', 'book__Title'),
+    ('checkout_date', 'checkout_date'),
+    ('due_date', 'due_date'),
+    ('return_date', 'return_date'),
+    ('penalty', 'penalty'),
+)
+
+BOOK_COLUMNS = (
+    ('id', 'id'),
+    ('isbn', 'ISBN'),
+    ('title', 'Title'),
+    ('author', 'Author'),
+    ('published_date', 'Published_date'),
+    ('copies_available', 'Number_of_copies_Available'),
+)
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Lets ?format=csv and Accept: text/csv through content negotiation. Export
+    views stream their own body; this only renders error responses.
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        writer = csv.writer(_Echo())
+        items = data.items() if isinstance(data, dict) else [('detail', data)]
+        return ''.join(writer.writerow([key, value]) for key, value in items)
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder) + '\n'
+
+
+class JSONExportRenderer(NDJSONRenderer):
+    """
+    Lets Accept: application/json through to NDJSON, the only JSON an export
+    streams: a single JSON document would be built in memory first.
+    """
+    media_type = 'application/json'
+
+
+# CSV unless the client asks for JSON, by ?format= or Accept.
+EXPORT_RENDERERS = [CSVRenderer, NDJSONRenderer, JSONExportRenderer]
+
+
+def iter_rows(queryset, fields, chunk_size=None):
+    """
+    Yield ``values_list(*fields)`` rows in primary-key order, one keyset
+    page of ``chunk_size`` at a time.
+
+    MySQLdb buffers a whole result set on the client even under
+    ``.iterator()``, so a plain iterator would hold the full export in
+    memory there; seeking by id keeps it flat on every backend.
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    queryset = queryset.order_by('pk').values_list('pk', *fields)
+    last = None
+    while True:
+        page = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(page[:chunk_size])
+        for row in rows:
+            yield row[1:]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][0]
+
+
+def export_response(querysets, columns, fmt, filename):
+    """Stream ``querysets``, one after the other, as CSV (with a header row) or NDJSON."""
+    headers = [header for header, _ in columns]
+    fields = [field for _, field in columns]
+    rows = chain.from_iterable(iter_rows(queryset, fields) for queryset in querysets)
+    if fmt == 'ndjson':
+        lines = (json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n' for row in rows)
+        content_type = NDJSONRenderer.media_type
+    else:
+        writer = csv.writer(_Echo())
+
+        def csv_lines():
+            yield writer.writerow(headers)
+            for row in rows:
+                yield writer.writerow(row)
+
+        lines = csv_lines()
+        content_type = f'{CSVRenderer.media_type}; charset=utf-8'
+        fmt = 'csv'
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
@@ -0,0 +1,117 @@
+from functools import lru_cache
+
+from django.conf import settings
+from rest_framework import ISO_8601, serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import serializer_timing
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _identity(value):
+    return value
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+@lru_cache(maxsize=None)
+def list_plan(serializer_class):
+    """
+    How to build ``serializer_class``'s output straight from ``.values()``
+    rows: a tuple of ``(output name, values() key, convert)``, in the
+    serializer's field order, write-only fields left out. None when a field
+    can't be read that way (nested serializers, dotted or ``*`` sources).
+
+    Plain columns whose database value is already what the field would
+    output are copied as is, ISO dates are formatted directly, and any other
+    field falls back to its own ``to_representation``.
+    """
+    plan = []
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                return None
+            convert = _identity
+        elif isinstance(field, (serializers.BaseSerializer, serializers.RelatedField, serializers.ManyRelatedField)):
+            return None
+        elif isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.BooleanField)):
+            convert = _identity
+        elif type(field) is serializers.DateField and getattr(field, 'format', api_settings.DATE_FORMAT) == ISO_8601:
+            convert = _isoformat
+        else:
+            convert = field.to_representation
+        plan.append((name, field.source, convert))
+    return tuple(plan)
+
+
+def fast_lists_enabled():
+    return getattr(settings, 'LIBRARY_FAST_LISTS', True)
+
+
+def values_for(queryset, serializer_class):
+    """``queryset.values()`` with the columns the fast path needs, or None."""
+    plan = list_plan(serializer_class)
+    if plan is None or not fast_lists_enabled():
+        return None
+    return queryset.values(*[source for _, source, _ in plan])
+
+
+def to_representation(rows, serializer_class):
+    """The serializer's ``many=True`` output for ``.values()`` rows."""
+    plan = list_plan(serializer_class)
+    with serializer_timing():
+        return [
+            {name: None if row[source] is None else convert(row[source]) for name, source, convert in plan}
+            for row in rows
+        ]
+
+
+class FastListMixin:
+    """
+    Serve ``list`` from ``.values()`` rows instead of model instances and
+    serializer fields, producing the same data as ``get_serializer(many=True)``.
+    Falls back to the regular path when the serializer has fields the fast
+    path can't reproduce, or when LIBRARY_FAST_LISTS is off.
+    """
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = values_for(queryset, self.get_serializer_class())
+        if rows is None:
+            return super().list(request, *args, **kwargs)
+        serializer_class = self.get_serializer_class()
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(to_representation(page, serializer_class))
+        return Response(to_representation(rows, serializer_class))
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed, producing
+    the same bytes as the default renderer. Indented or ASCII-only output
+    (the browsable API, ``; indent=``, UNICODE_JSON off) goes through the
+    default renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type or '', renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        # Dates, times and anything orjson doesn't know go through DRF's
+        # encoder so they are formatted exactly as before.
+        ret = orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
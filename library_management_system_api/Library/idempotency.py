@@ -0,0 +1,123 @@
+import hashlib
+import json
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+RESULT_KEY = 'library:idempotency:{}:{}:result'
+LOCK_KEY = 'library:idempotency:{}:{}:lock'
+POLL_INTERVAL = 0.05
+# How long a key stays claimed by a request that never finishes (a killed worker).
+LOCK_TIMEOUT = 60
+
+
+def get_cache():
+    return caches[getattr(settings, 'LIBRARY_IDEMPOTENCY_CACHE', 'default')]
+
+
+def get_ttl():
+    return getattr(settings, 'LIBRARY_IDEMPOTENCY_TTL', 86400)
+
+
+def get_wait():
+    return getattr(settings, 'LIBRARY_IDEMPOTENCY_WAIT', 5)
+
+
+def fingerprint(request):
+    """What a key was first used for: method, path and body."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return hashlib.md5(payload.encode(), usedforsecurity=False).hexdigest()
+
+
+def _replay(stored):
+    fp, code, data = stored
+    response = Response(data, status=code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _wait_for(cache, result_key, lock_key):
+    # Another worker holds the key; poll until it stores its response or
+    # gives up the lock.
+    deadline = time.monotonic() + get_wait()
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        stored = cache.get(result_key)
+        if stored is not None or cache.get(lock_key) is None:
+            return stored
+    return None
+
+
+def _release(cache, lock_key, token):
+    # Only our own claim: past LOCK_TIMEOUT another request may hold the key.
+    # Caches have no compare-and-delete; the gap between get and delete is
+    # negligible next to LOCK_TIMEOUT.
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+def idempotent(view):
+    """
+    Honour an Idempotency-Key header on a viewset write action.
+
+    The first response for a (user, key) pair is kept in the idempotency
+    cache for LIBRARY_IDEMPOTENCY_TTL seconds and replayed for retries,
+    without calling the view. A retry that arrives while the first request
+    is still running waits up to LIBRARY_IDEMPOTENCY_WAIT seconds for its
+    response, so the work runs once; past that it gets a 409. Reusing a key
+    for a different request is a 422. Server errors are not stored, and
+    requests without the header are not affected.
+    """
+    @wraps(view)
+    def wrapped(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(self, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response({"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}, status=status.HTTP_400_BAD_REQUEST)
+        cache = get_cache()
+        digest = hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+        result_key = RESULT_KEY.format(request.user.pk, digest)
+        lock_key = LOCK_KEY.format(request.user.pk, digest)
+        fp = fingerprint(request)
+        token = uuid.uuid4().hex
+
+        stored = cache.get(result_key)
+        if stored is None:
+            if cache.add(lock_key, token, LOCK_TIMEOUT):
+                # The first request may have stored its response and released
+                # the key between the get and the add.
+                stored = cache.get(result_key)
+                if stored is not None:
+                    _release(cache, lock_key, token)
+            else:
+                stored = _wait_for(cache, result_key, lock_key)
+                if stored is None:
+                    response = Response({"error": "A request with this Idempotency-Key is still in progress"}, status=status.HTTP_409_CONFLICT)
+                    response['Retry-After'] = '1'
+                    return response
+        if stored is not None:
+            if stored[0] != fp:
+                return Response({"error": f"{HEADER} was already used for a different request"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return _replay(stored)
+
+        try:
+            response = view(self, request, *args, **kwargs)
+            if response.status_code < 500:
+                # Plain types, so the entry survives any cache serializer.
+                data = json.loads(json.dumps(response.data, default=str))
+                cache.set(result_key, (fp, response.status_code, data), get_ttl())
+            return response
+        finally:
+            _release(cache, lock_key, token)
+    return wrapped
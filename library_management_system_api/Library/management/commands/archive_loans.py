@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Library.archive import archive_cutoff, archive_loans
+
+
+class Command(BaseCommand):
+    help = 'Move returned loans older than LIBRARY_ARCHIVE_AFTER_DAYS into the archive table, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=None, metavar='DAYS', help='Archive loans returned more than DAYS ago.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Loans moved per transaction.')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches.')
+        parser.add_argument('--max-batches', type=int, default=None, help='Stop after this many batches; rerun to continue.')
+
+    def handle(self, *args, **options):
+        before = archive_cutoff(days=options['older_than'])
+        started = time.monotonic()
+        moved = archive_loans(
+            before,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_batches=options['max_batches'],
+            on_batch=lambda moved: self.stdout.write(f'  {moved} loans archived'),
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Archived {moved} loans returned before {before} in {elapsed:.2f}s')
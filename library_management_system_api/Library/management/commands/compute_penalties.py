@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Library.services import recompute_penalties
+
+
+class Command(BaseCommand):
+    help = 'Recompute penalties for all overdue open loans at LIBRARY_PENALTY_PER_DAY, in chunked, set-based updates.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Loans covered by each UPDATE.')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        touched = recompute_penalties(
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Updated penalties on {touched} loans in {elapsed:.2f}s')
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Library.catalog_import import detect_format, import_books, read_records
+
+
+class Command(BaseCommand):
+    help = 'Stream books from a CSV or JSON Lines file and upsert them on ISBN in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with a header row, or JSON Lines (.jsonl/.ndjson).')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT and transaction.')
+        parser.add_argument(
+            '--update-copies', action='store_true',
+            help='Also overwrite Number_of_copies_Available on existing books. Off by default, since '
+                 'the stored count already reflects copies that are out on loan.',
+        )
+        parser.add_argument('--checkpoint', help='Progress file; defaults to PATH.checkpoint.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+        parser.add_argument('--rejects', help='Append rejected rows to this file as JSON Lines.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'{path} does not exist')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        fmt = options['format'] or detect_format(path)
+        checkpoint = options['checkpoint'] or f'{path}.checkpoint'
+        size = os.path.getsize(path)
+
+        state = {'size': size, 'position': 0, 'imported': 0, 'rejected': 0}
+        if os.path.exists(checkpoint) and not options['restart']:
+            with open(checkpoint) as f:
+                saved = json.load(f)
+            if saved.get('size') != size:
+                raise CommandError(f'{path} changed since {checkpoint} was written; pass --restart to start over.')
+            state = saved
+            self.stdout.write(f'Resuming after row {state["position"]}')
+
+        update_fields = ['Title', 'Author']
+        if options['update_copies']:
+            update_fields.append('Number_of_copies_Available')
+
+        rejects = open(options['rejects'], 'a') if options['rejects'] else None
+        started = time.monotonic()
+        resumed_at = state['position']
+
+        def on_batch(position, imported, errors):
+            state.update(
+                position=position,
+                imported=state['imported'] + imported,
+                rejected=state['rejected'] + len(errors),
+            )
+            tmp = f'{checkpoint}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, checkpoint)
+            for row, reason in errors:
+                if rejects is not None:
+                    rejects.write(json.dumps({'row': row, 'error': reason}) + '\n')
+                if options['verbosity'] > 1:
+                    self.stderr.write(f'Row {row} rejected: {reason}')
+            rate = (position - resumed_at) / max(time.monotonic() - started, 1e-9)
+            if options['verbosity'] > 0:
+                self.stdout.write(f'{position} rows read, {state["imported"]} imported, {state["rejected"]} rejected ({rate:.0f} rows/s)')
+
+        try:
+            with open(path, newline='', encoding='utf-8') as stream:
+                import_books(
+                    read_records(stream, fmt),
+                    batch_size=options['batch_size'],
+                    skip=state['position'],
+                    update_fields=update_fields,
+                    on_batch=on_batch,
+                )
+        finally:
+            if rejects is not None:
+                rejects.close()
+
+        elapsed = time.monotonic() - started
+        rate = (state['position'] - resumed_at) / max(elapsed, 1e-9)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        self.stdout.write(
+            f'Imported {state["imported"]} books, rejected {state["rejected"]} rows '
+            f'in {elapsed:.2f}s ({rate:.0f} rows/s)'
+        )
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Library.outbox import drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued emails from the outbox over a reused connection, with retries and backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=8)
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting when the outbox is empty.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_outbox(options['batch_size'], options['max_attempts'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(f'Sent {sent} emails, {failed} failed')
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,266 @@
+import atexit
+import contextvars
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+# Upper bounds of the histogram buckets; +Inf is implied.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+HISTOGRAMS = {
+    'library_http_request_duration_seconds': ('Wall time of a request, middleware included.', DURATION_BUCKETS),
+    'library_http_request_db_queries': ('SQL statements run by a request.', QUERY_COUNT_BUCKETS),
+    'library_http_request_db_seconds': ('Time a request spent waiting on SQL statements.', DURATION_BUCKETS),
+    'library_http_request_serializer_seconds': ('Time a request spent in DRF serializers.', DURATION_BUCKETS),
+}
+
+UNRESOLVED = '<unresolved>'
+
+_request = contextvars.ContextVar('library_metrics_request', default=None)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+
+class Registry:
+    """
+    In-process histograms, keyed by metric name and label values.
+
+    Each series is a list of bucket counts (the last one for +Inf) followed
+    by the sum and the count, so recording an observation is a bisect and
+    three additions under one lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(buckets) + 3)
+            series[bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return [[name, list(labels), list(series)] for (name, labels), series in self.series.items()]
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+
+registry = Registry()
+
+
+def _labels_text(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+def merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, series in snapshot:
+            if name not in HISTOGRAMS:
+                continue
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if len(series) != len(HISTOGRAMS[name][1]) + 3:
+                continue  # written with different buckets by an older release
+            current = merged.get(key)
+            merged[key] = list(series) if current is None else [a + b for a, b in zip(current, series)]
+    return merged
+
+
+def render(merged):
+    """Format merged series in the Prometheus text exposition format."""
+    lines = []
+    for name, (help_text, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for (series_name, labels), series in sorted(merged.items()):
+            if series_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), series[:-2]):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'{name}_bucket{{{_labels_text((*labels, ("le", le)))}}} {cumulative}')
+            lines.append(f'{name}_sum{{{_labels_text(labels)}}} {series[-2]!r}')
+            lines.append(f'{name}_count{{{_labels_text(labels)}}} {series[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def multiprocess_dir():
+    return getattr(settings, 'LIBRARY_METRICS_MULTIPROCESS_DIR', None)
+
+
+class _Flusher:
+    """
+    Multi-process mode: each worker writes its histograms to its own file in
+    LIBRARY_METRICS_MULTIPROCESS_DIR, at most every
+    LIBRARY_METRICS_FLUSH_INTERVAL seconds and at exit, and /metrics sums the
+    files of every worker. Files are named by pid and start time, so a
+    restarted worker never overwrites the totals of the one it replaced.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = 0.0
+        self.name = f'{os.getpid()}-{time.time_ns()}.json'
+        self.registered = False
+
+    def path(self, directory):
+        # A forked worker inherits the parent's flusher; give it its own file.
+        if not self.name.startswith(f'{os.getpid()}-'):
+            self.name = f'{os.getpid()}-{time.time_ns()}.json'
+        return os.path.join(directory, self.name)
+
+    def flush(self, force=False):
+        directory = multiprocess_dir()
+        if not directory:
+            return
+        now = time.monotonic()
+        interval = getattr(settings, 'LIBRARY_METRICS_FLUSH_INTERVAL', 5)
+        if not force and now - self.last < interval:
+            return
+        if not self.lock.acquire(blocking=force):
+            return
+        try:
+            self.last = now
+            if not self.registered:
+                atexit.register(self.flush, force=True)
+                self.registered = True
+            path = self.path(directory)
+            tmp = f'{path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(tmp, path)
+        finally:
+            self.lock.release()
+
+
+flusher = _Flusher()
+
+
+def collect():
+    """
+    The text for /metrics: this process's histograms, or in multi-process
+    mode those of every worker that has written to the shared directory.
+    """
+    directory = multiprocess_dir()
+    if not directory:
+        return render(merge([registry.snapshot()]))
+    flusher.flush(force=True)
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return render(merge(snapshots))
+
+
+def _time_queries(execute, sql, params, many, context):
+    stats = _request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED
+    return match.view_name or match.route or UNRESOLVED
+
+
+class MetricsMiddleware:
+    """
+    Record per-request wall time, SQL count, SQL time and serializer time,
+    labelled by URL name and method, into the histograms served on /metrics.
+
+    Put it first in MIDDLEWARE so the timings include the rest of the stack.
+    Queries made while a StreamingHttpResponse is consumed happen after the
+    middleware has returned and are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = _request.set(stats)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all(initialized_only=False):
+                    stack.enter_context(connection.execute_wrapper(_time_queries))
+                response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        elapsed = time.perf_counter() - started
+
+        route = route_name(request)
+        labels = (('route', route), ('method', request.method))
+        registry.observe('library_http_request_duration_seconds', (*labels, ('status', str(response.status_code))), elapsed)
+        registry.observe('library_http_request_db_queries', labels, stats.queries)
+        registry.observe('library_http_request_db_seconds', labels, stats.db_time)
+        registry.observe('library_http_request_serializer_seconds', labels, stats.serializer_time)
+        flusher.flush()
+        return response
+
+
+@contextmanager
+def serializer_timing():
+    """
+    Add the time spent in the block to the current request's serializer
+    time. Nested blocks are only counted once, by the outermost one.
+    """
+    stats = _request.get()
+    if stats is None or stats.serializer_depth:
+        yield
+        return
+    stats.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.serializer_time += time.perf_counter() - started
+        stats.serializer_depth -= 1
+
+
+class TimedSerializerMixin:
+    """
+    Count ``to_representation`` as serializer time. Only the outermost call
+    is timed, so nested and ``many=True`` serializers are counted once.
+    """
+
+    def to_representation(self, instance):
+        with serializer_timing():
+            return super().to_representation(instance)
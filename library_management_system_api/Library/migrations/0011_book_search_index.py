@@ -0,0 +1,51 @@
+from django.db import migrations
+
+FTS_TABLE = 'Library_book_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE `Library_book` ADD FULLTEXT INDEX `book_fulltext` (`Title`, `Author`, `ISBN`)'
+        )
+    elif vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            f"Title, Author, ISBN, content='Library_book', content_rowid='id')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON Library_book BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, Title, Author, ISBN) VALUES (new.id, new.Title, new.Author, new.ISBN); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON Library_book BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, Title, Author, ISBN) VALUES ('delete', old.id, old.Title, old.Author, old.ISBN); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF Title, Author, ISBN ON Library_book BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, Title, Author, ISBN) VALUES ('delete', old.id, old.Title, old.Author, old.ISBN); "
+            f"INSERT INTO {FTS_TABLE}(rowid, Title, Author, ISBN) VALUES (new.id, new.Title, new.Author, new.ISBN); END"
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE `Library_book` DROP INDEX `book_fulltext`')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0010_remove_user_is_staff_remove_user_role_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
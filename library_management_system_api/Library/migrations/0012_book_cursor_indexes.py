@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0011_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['Title', 'id'], name='book_title_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['Author', 'id'], name='book_author_id_idx'),
+        ),
+    ]
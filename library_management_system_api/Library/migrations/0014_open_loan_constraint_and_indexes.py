@@ -0,0 +1,33 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0013_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='transactions',
+            unique_together=set(),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['user', 'return_date'], name='loan_user_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['book', 'return_date'], name='loan_book_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['due_date', 'return_date'], name='loan_due_open_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='transactions',
+            constraint=models.UniqueConstraint(models.F('user'), models.F('book'), models.Case(models.When(return_date__isnull=True, then=models.Value(1))), name='one_open_loan_per_user_book'),
+        ),
+    ]
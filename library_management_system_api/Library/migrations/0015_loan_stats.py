@@ -0,0 +1,37 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0014_open_loan_constraint_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLoanStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('open_due', models.IntegerField(default=0)),
+                ('penalties_assessed', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Library.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'book'), name='book_daily_stats_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.3 on 2026-10-18 00:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+COLUMNS = ('id', 'user_id', 'book_id', 'checkout_date', 'return_date', 'due_date', 'penalty')
+
+
+def create_loan_history_view(apps, schema_editor):
+    quote = schema_editor.connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in COLUMNS)
+    schema_editor.execute(
+        f'CREATE VIEW {quote("Library_loanhistory")} AS '
+        f'SELECT {columns} FROM {quote("Library_transactions")} '
+        f'UNION ALL SELECT {columns} FROM {quote("Library_archivedtransaction")}'
+    )
+
+
+def drop_loan_history_view(apps, schema_editor):
+    schema_editor.execute(f'DROP VIEW {schema_editor.connection.ops.quote_name("Library_loanhistory")}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Library', '0015_loan_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_date', models.DateField()),
+                ('return_date', models.DateField(null=True)),
+                ('due_date', models.DateField()),
+                ('penalty', models.DecimalField(decimal_places=2, max_digits=5)),
+            ],
+            options={
+                'db_table': 'Library_loanhistory',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('checkout_date', models.DateField()),
+                ('return_date', models.DateField()),
+                ('due_date', models.DateField()),
+                ('penalty', models.DecimalField(decimal_places=2, default=0, max_digits=5)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to='Library.book')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_loans', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'checkout_date'], name='archived_loan_user_idx')],
+            },
+        ),
+        migrations.RunPython(create_loan_history_view, drop_loan_history_view),
+    ]
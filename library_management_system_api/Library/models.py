@@ -1,4 +1,8 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
 from datetime import timedelta
@@ -13,10 +17,40 @@ class Book(models.Model):
     Published_date = models.DateField(auto_now_add=True)
     Number_of_copies_Available = models.IntegerField()
 
+    class Meta:
+        # Seek keys for BookView's cursor pagination on its default orderings.
+        indexes = [
+            models.Index(fields=['Title', 'id'], name='book_title_id_idx'),
+            models.Index(fields=['Author', 'id'], name='book_author_id_idx'),
+        ]
+
     def __str__(self):
         return self.Title
 
-class UserManager(BaseUserManager):
+class UserQuerySet(models.QuerySet):
+    def with_loan_totals(self):
+        """
+        Annotate ``active_loans`` and ``penalties`` (the sum over all loans,
+        archived ones included).
+        Correlated subqueries rather than a join and GROUP BY, so only the
+        rows fetched (one page) are aggregated, each from the user's loans.
+        """
+        loans = Transactions.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        archived = ArchivedTransaction.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        open_loans = loans.filter(return_date__isnull=True).annotate(count=Count('id')).values('count')
+
+        def penalties(queryset):
+            return Coalesce(
+                Subquery(queryset.annotate(total=Sum('penalty')).values('total')), Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+
+        return self.annotate(
+            active_loans=Coalesce(Subquery(open_loans), 0),
+            penalties=penalties(loans) + penalties(archived),
+        )
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     def create_user(self, email, username, password=None):
         if not email:
             raise ValueError("Users must have an email address")
@@ -62,6 +96,15 @@ class User(AbstractBaseUser, PermissionsMixin):
     def has_perm(self, perm, obj=None):
         return self.is_admin
 
+    def get_session_auth_hash(self):
+        # Users rebuilt from the user cache carry the hash, not the password.
+        cached = self.__dict__.get('_session_auth_hash')
+        return cached if cached is not None else super().get_session_auth_hash()
+
+    def set_password(self, raw_password):
+        self.__dict__.pop('_session_auth_hash', None)
+        super().set_password(raw_password)
+
     def has_module_perms(self, app_label):
         return True
     
@@ -70,6 +113,11 @@ class User(AbstractBaseUser, PermissionsMixin):
     def is_staff(self):
         return self.is_admin
 
+class TransactionsQuerySet(models.QuerySet):
+    def with_related(self):
+        # __str__ and the borrowing templates read user.username and book.Title.
+        return self.select_related('user', 'book')
+
 class Transactions(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -78,8 +126,119 @@ class Transactions(models.Model):
     due_date = models.DateField(default=timezone.now() + timedelta(days=14))
     penalty = models.DecimalField(max_digits=5, decimal_places=2, default=0.00)
 
+    objects = TransactionsQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One open loan per user and book; returned loans don't count, so a
+            # patron can borrow a title again. MySQL has no partial indexes, so
+            # this is a functional unique key that is NULL for returned loans.
+            models.UniqueConstraint(
+                'user', 'book',
+                models.Case(models.When(return_date__isnull=True, then=models.Value(1))),
+                name='one_open_loan_per_user_book',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'return_date'], name='loan_user_open_idx'),
+            models.Index(fields=['book', 'return_date'], name='loan_book_open_idx'),
+            models.Index(fields=['due_date', 'return_date'], name='loan_due_open_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} checked out {self.book.Title}"
+
+class ArchivedTransaction(models.Model):
+    """
+    A returned loan moved out of Transactions by the archive_loans command,
+    under its original id, so the live table only holds recent loans.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_loans')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='archived_loans')
+    checkout_date = models.DateField()
+    return_date = models.DateField()
+    due_date = models.DateField()
+    penalty = models.DecimalField(max_digits=5, decimal_places=2, default=0)
+
+    objects = TransactionsQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'checkout_date'], name='archived_loan_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} checked out {self.book.Title}"
+
+class LoanHistory(models.Model):
+    """
+    Every loan, live or archived: a read-only database view (UNION ALL of
+    Transactions and ArchivedTransaction) for the pages that show loan
+    histories. Filters on user and dates are pushed into both halves by
+    PostgreSQL, SQLite and MySQL 8.0.29+. Write to Transactions.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    book = models.ForeignKey(Book, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    checkout_date = models.DateField()
+    return_date = models.DateField(null=True)
+    due_date = models.DateField()
+    penalty = models.DecimalField(max_digits=5, decimal_places=2)
+
+    objects = TransactionsQuerySet.as_manager()
+
+    class Meta:
+        managed = False
+        db_table = 'Library_loanhistory'
+
+    def __str__(self):
+        return f"{self.user.username} checked out {self.book.Title}"
+
+class OutboxEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.EmailField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent_at', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to}"
+
+
+class DailyLoanStats(models.Model):
+    """
+    Loan counters for one day, kept current by the checkout and return paths
+    (see Library.stats) so the dashboard never aggregates Transactions.
+    """
+    date = models.DateField(unique=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    # Loans due on this date that are still open.
+    open_due = models.IntegerField(default=0)
+    penalties_assessed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Loan stats for {self.date}"
+
+
+class BookDailyStats(models.Model):
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    date = models.DateField()
+    checkouts = models.PositiveIntegerField(default=0)
+
     class Meta:
-        unique_together = ('user', 'book')
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'book'], name='book_daily_stats_unique'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} checked out {self.book.Title}"
\ No newline at end of file
+        return f"{self.book_id} checked out {self.checkouts} times on {self.date}"
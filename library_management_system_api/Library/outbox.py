@@ -0,0 +1,122 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+# A worker that dies mid-batch releases its claim after this long.
+CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+def enqueue_email(subject, body, to, from_email=None):
+    """
+    Queue an email for the delivery worker.
+
+    Call it inside the transaction that makes the email true, so the message
+    is stored exactly when the change commits and never blocks the request.
+    """
+    return OutboxEmail.objects.create(
+        subject=subject, body=body, to=to,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def enqueue_emails(messages):
+    """Queue several ``(subject, body, to)`` messages with one INSERT."""
+    return OutboxEmail.objects.bulk_create([
+        OutboxEmail(subject=subject, body=body, to=to, from_email=settings.DEFAULT_FROM_EMAIL)
+        for subject, body, to in messages
+    ])
+
+
+def retry_delay(attempts, base=timedelta(seconds=30), cap=timedelta(hours=1)):
+    return min(base * 2 ** (attempts - 1), cap)
+
+
+def claim_batch(batch_size, max_attempts):
+    """
+    Claim up to ``batch_size`` due emails by pushing their next attempt past
+    the claim timeout. SKIP LOCKED lets several workers drain concurrently.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, next_attempt_at__lte=now, attempts__lt=max_attempts)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            OutboxEmail.objects.filter(id__in=[email.id for email in batch]).update(
+                next_attempt_at=now + CLAIM_TIMEOUT
+            )
+    return batch
+
+
+def deliver_batch(batch, connection):
+    """
+    Send a claimed batch over an open email connection and record the
+    outcome. Returns ``(sent, failed)``.
+    """
+    sent = failed = 0
+    for email in batch:
+        email.attempts += 1
+        try:
+            EmailMessage(email.subject, email.body, email.from_email, [email.to], connection=connection).send()
+        except Exception as e:
+            failed += 1
+            email.last_error = str(e)
+            email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+            logger.warning('Outbox email %s failed (attempt %s): %s', email.id, email.attempts, e)
+            _reconnect(connection)
+        else:
+            sent += 1
+            email.sent_at = timezone.now()
+            email.last_error = ''
+    OutboxEmail.objects.bulk_update(batch, ['attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+    return sent, failed
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _open(connection):
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning('Could not open email connection: %s', e)
+
+
+def _reconnect(connection):
+    # Drop a possibly broken session so the rest of the batch gets a fresh one.
+    _close(connection)
+    _open(connection)
+
+
+def drain_outbox(batch_size=100, max_attempts=8):
+    """
+    Deliver every email that is currently due over a single connection.
+    Returns ``(sent, failed)``.
+    """
+    sent = failed = 0
+    connection = get_connection()
+    _open(connection)
+    try:
+        while True:
+            batch = claim_batch(batch_size, max_attempts)
+            if not batch:
+                return sent, failed
+            batch_sent, batch_failed = deliver_batch(batch, connection)
+            sent += batch_sent
+            failed += batch_failed
+    finally:
+        _close(connection)
@@ -0,0 +1,153 @@
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Opt-in keyset (seek) pagination, enabled by passing ``?cursor=``.
+
+    The cursor holds the ordering-key values of the last row served, and the
+    next page is fetched with ``WHERE (keys) > (values)`` instead of an
+    OFFSET, so deep pages cost the same as the first one and no COUNT(*) is
+    run. The queryset's ordering is used as-is with the primary key appended
+    as a tiebreak.
+
+    Without ``?cursor=`` the request is handed to ``fallback_class``, or left
+    unpaginated when there is none, so existing clients see no change.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = None
+    fallback_class = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.fallback = None
+        if self.cursor_query_param not in request.query_params:
+            if self.fallback_class is None:
+                return None
+            self.fallback = self.fallback_class()
+            return self.fallback.paginate_queryset(queryset, request, view)
+
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        queryset, self.keys = self.get_ordering_keys(queryset)
+        position, reverse = self.decode_cursor(request)
+
+        if reverse:
+            queryset = queryset.order_by(*[name[1:] if name.startswith('-') else f'-{name}' for name in queryset.query.order_by])
+        if position is not None:
+            queryset = queryset.filter(self.seek(position, reverse))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering_keys(self, queryset):
+        model = queryset.model
+        ordering = list(self.ordering or queryset.query.order_by or model._meta.ordering)
+        keys, names = [], set()
+        for name in ordering:
+            if not isinstance(name, str):
+                raise ValidationError({'cursor': 'Cursor pagination needs plain field ordering.'})
+            descending = name.startswith('-')
+            field_name = name.lstrip('-')
+            try:
+                field = model._meta.pk if field_name == 'pk' else model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                raise ValidationError({'cursor': f'Cursor pagination cannot order by "{field_name}"; pass an explicit ?ordering=.'})
+            if field.null or not field.concrete:
+                raise ValidationError({'cursor': f'Cursor pagination cannot order by "{field_name}".'})
+            if field.attname not in names:
+                keys.append((field, descending))
+                names.add(field.attname)
+        if model._meta.pk.attname not in names:
+            keys.append((model._meta.pk, False))
+        order_by = [f'-{field.attname}' if descending else field.attname for field, descending in keys]
+        selected = queryset.query.values_select
+        if selected:
+            # A .values() queryset must also fetch the keys the cursor is built from.
+            missing = [field.attname for field, _ in keys if field.attname not in selected and field.name not in selected]
+            if missing:
+                queryset = queryset.values(*selected, *missing)
+        return queryset.order_by(*order_by), keys
+
+    def seek(self, position, reverse):
+        # (a > x) OR (a = x AND b > y) OR ..., with < for descending keys.
+        condition, equal = None, Q()
+        for (field, descending), value in zip(self.keys, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = equal & Q(**{f'{field.attname}__{lookup}': value})
+            condition = clause if condition is None else condition | clause
+            equal &= Q(**{field.attname: value})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = payload['v']
+            if len(values) != len(self.keys):
+                raise ValueError
+            position = [field.to_python(value) for (field, _), value in zip(self.keys, values)]
+            return position, bool(payload.get('r'))
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, row, reverse):
+        if isinstance(row, dict):
+            # .values() rows are keyed by field name, which for a foreign key
+            # holds the same value as the attname.
+            values = [row[field.attname] if field.attname in row else row[field.name] for field, _ in self.keys]
+        else:
+            values = [getattr(row, field.attname) for field, _ in self.keys]
+        payload = json.dumps({'v': values, 'r': int(reverse)}, cls=DjangoJSONEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
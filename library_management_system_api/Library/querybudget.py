@@ -0,0 +1,84 @@
+from contextlib import ContextDecorator, ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+# Transaction control is not a round trip we can design away, and whether it
+# shows up depends on TestCase vs TransactionTestCase, so it is not counted.
+_CONTROL_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def counted_queries(captured):
+    return [q for q in captured if not q['sql'].upper().startswith(_CONTROL_PREFIXES)]
+
+
+class query_budget(ContextDecorator):
+    """
+    Fail when more than ``limit`` SQL statements run inside the block, on
+    every database alias (replicas included) unless ``using`` names one.
+
+    Usable as a context manager in tests::
+
+        with query_budget(2):
+            self.client.get('/borrowings/')
+
+    or as a decorator on a test method.
+    """
+
+    def __init__(self, limit, using=None, label=None):
+        self.limit = limit
+        self.using = using
+        self.label = label
+
+    def _record(self, alias):
+        def wrapper(execute, sql, params, many, context):
+            self.captured.append({'alias': alias, 'sql': sql})
+            return execute(sql, params, many, context)
+        return wrapper
+
+    def __enter__(self):
+        self.captured = []
+        self._stack = ExitStack()
+        # Wrappers don't open connections, so idle aliases cost nothing.
+        targets = [connections[self.using]] if self.using else connections.all(initialized_only=False)
+        for connection in targets:
+            self._stack.enter_context(connection.execute_wrapper(self._record(connection.alias)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stack.close()
+        if exc_type is not None:
+            return False
+        self.queries = counted_queries(self.captured)
+        if len(self.queries) > self.limit:
+            listing = '\n'.join(f'{n}. [{q["alias"]}] {q["sql"]}' for n, q in enumerate(self.queries, start=1))
+            raise QueryBudgetExceeded(
+                f'{self.label or "block"} ran {len(self.queries)} queries, budget is {self.limit}:\n{listing}'
+            )
+        return False
+
+
+def declare_query_budget(limit):
+    """
+    Declare how many queries a view may run.
+
+    The budget is stored on the view as ``query_budget`` and enforced when
+    LIBRARY_ENFORCE_QUERY_BUDGETS is on, which the test suite turns on for
+    the views it exercises. Queries made by outer decorators (session and
+    user loading) are not part of the budget.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if not getattr(settings, 'LIBRARY_ENFORCE_QUERY_BUDGETS', False):
+                return view(*args, **kwargs)
+            with query_budget(limit, label=view.__qualname__):
+                return view(*args, **kwargs)
+        wrapped.query_budget = limit
+        return wrapped
+    return decorator
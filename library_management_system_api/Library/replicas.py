@@ -0,0 +1,128 @@
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_KEY = 'library:replica:pin:{}'
+
+_read_alias = contextvars.ContextVar('library_read_alias', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'LIBRARY_READ_REPLICAS', []))
+
+
+def _cache():
+    return caches[getattr(settings, 'LIBRARY_REPLICA_PIN_CACHE', 'default')]
+
+
+def pin_to_primary(user_id):
+    """Send ``user_id``'s replica reads to the primary for the pin window."""
+    seconds = getattr(settings, 'LIBRARY_REPLICA_PIN_SECONDS', 5)
+    if seconds and replicas():
+        _cache().set(PIN_KEY.format(user_id), 1, seconds)
+
+
+def is_pinned(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    return bool(_cache().get(PIN_KEY.format(user.pk)))
+
+
+class ReplicaRouter:
+    """
+    Send reads made inside a ``read_from_replica`` view to one of
+    LIBRARY_READ_REPLICAS, and everything else to the primary. Replicas are
+    copies of the primary, so they are never migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Reads inside a transaction must see its own writes.
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()
+
+
+@contextmanager
+def use_primary():
+    """
+    Read from the primary inside the block, even in a read_from_replica view.
+    For reads whose result outlives the request, such as cache fills: a
+    lagging replica's rows would otherwise be cached as current.
+    """
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def _stream_from(chunks, alias):
+    # Streaming bodies are read after the view returns, so route each chunk.
+    chunks = iter(chunks)
+    while True:
+        token = _read_alias.set(alias)
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            _read_alias.reset(token)
+        yield chunk
+
+
+def read_from_replica(view):
+    """
+    Let a view's safe requests read from a replica. Requests from a user
+    who recently wrote something stay on the primary (see ReplicaPinMiddleware).
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        pool = replicas()
+        if not pool or request.method not in SAFE_METHODS or is_pinned(request):
+            return view(request, *args, **kwargs)
+        alias = random.choice(pool)
+        token = _read_alias.set(alias)
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+        if getattr(response, 'streaming', False) and not response.is_async:
+            response.streaming_content = _stream_from(response.streaming_content, alias)
+        return response
+    return wrapped
+
+
+class ReplicaPinMiddleware:
+    """
+    After a successful write, pin the user to the primary for
+    LIBRARY_REPLICA_PIN_SECONDS, so they read their own writes (a checkout,
+    a return) whatever the replication lag.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replicas():
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.pk)
+        return response
@@ -0,0 +1,250 @@
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache, reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+from .models import Book
+
+SEARCH_FIELDS = ('Title', 'Author', 'ISBN')
+FTS_TABLE = 'Library_book_fts'
+
+_token_re = re.compile(r'\w+')
+
+# InnoDB's default full-text stopwords (INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD).
+MYSQL_STOPWORDS = frozenset('''
+    a about an are as at be by com de en for from how i in is it la of on or
+    that the this to was what when where who will with und www
+'''.split())
+
+
+def tokenize(text):
+    return [token.lower() for token in _token_re.findall(text or '')]
+
+
+class BaseSearchBackend:
+    """
+    Full-text search over the book catalog.
+
+    ``search`` is only called with at least one searchable token. It narrows
+    a Book queryset to the matches and annotates each row with
+    ``search_rank`` (higher is more relevant). ``index`` and ``remove`` are
+    called from the Book signals, ``index_many`` after bulk writes that send
+    none; backends whose index lives in the database keep them as no-ops.
+    """
+
+    def search(self, queryset, terms):
+        raise NotImplementedError
+
+    def index(self, book):
+        pass
+
+    def index_many(self, book_ids):
+        """Reindex books written without signals, such as bulk upserts."""
+        pass
+
+    def remove(self, book_id):
+        pass
+
+
+def contains_all(queryset, terms):
+    """
+    Books with every term somewhere in Title, Author or ISBN: the icontains
+    matching of DRF's stock SearchFilter.
+    """
+    for term in terms:
+        queryset = queryset.filter(reduce(or_, (Q(**{f'{field}__icontains': term}) for field in SEARCH_FIELDS)))
+    return queryset
+
+
+class ORMSearchBackend(BaseSearchBackend):
+    """
+    Plain icontains filters, for databases without a full-text index here.
+    Every match ranks the same, so results keep the view's ordering.
+    """
+
+    def search(self, queryset, terms):
+        return contains_all(queryset, terms).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class MySQLFullTextBackend(BaseSearchBackend):
+    """
+    Uses the FULLTEXT index created by migration 0011.
+
+    InnoDB leaves words shorter than innodb_ft_min_token_size, and its
+    stopwords, out of the index, so requiring them would match nothing.
+    Terms containing such a word (ISBN fragments like 978-0-1, initials) are
+    matched with icontains instead, among the rows the other terms select
+    through the index.
+    """
+
+    def split_terms(self, terms):
+        """(BOOLEAN MODE query for the indexable terms, terms left to icontains)."""
+        min_size = getattr(settings, 'LIBRARY_SEARCH_MIN_TOKEN_SIZE', 3)
+        required, fallback = [], []
+        for term in terms:
+            tokens = tokenize(term)
+            if all(len(token) >= min_size and token not in MYSQL_STOPWORDS for token in tokens):
+                required += tokens
+            else:
+                fallback.append(term)
+        # Every indexed term must match, as a prefix, in any of the columns.
+        return ' '.join(f'+{token}*' for token in required), fallback
+
+    def search(self, queryset, terms):
+        query, fallback = self.split_terms(terms)
+        queryset = contains_all(queryset, fallback)
+        if not query:
+            return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        qn = connection.ops.quote_name
+        columns = ', '.join(f'{qn(Book._meta.db_table)}.{qn(field)}' for field in SEARCH_FIELDS)
+        match = RawSQL(f'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)', (query,), output_field=FloatField())
+        return queryset.annotate(search_rank=match).filter(search_rank__gt=0)
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """Uses the FTS5 table and triggers created by migration 0011."""
+
+    def search(self, queryset, terms):
+        query = ' '.join(f'"{token}"*' for term in terms for token in tokenize(term))
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {Book._meta.db_table}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[query],
+            select={'search_rank': f'-bm25({FTS_TABLE})'},
+        )
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """
+    Inverted index held in process memory, built lazily on first search.
+    Each worker only sees its own saves, so this is for tests and single
+    process deployments; it must be selected explicitly.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = None
+        self._documents = {}
+
+    def _build(self):
+        postings = defaultdict(dict)
+        documents = {}
+        for book_id, *values in Book.objects.values_list('id', *SEARCH_FIELDS).iterator():
+            tokens = tokenize(' '.join(values))
+            documents[book_id] = tokens
+            for token in tokens:
+                postings[token][book_id] = postings[token].get(book_id, 0) + 1
+        self._postings, self._documents = postings, documents
+
+    def _ensure_built(self):
+        if self._postings is None:
+            with self._lock:
+                if self._postings is None:
+                    self._build()
+
+    def index(self, book):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._discard(book.pk)
+            tokens = tokenize(' '.join(str(getattr(book, field)) for field in SEARCH_FIELDS))
+            self._documents[book.pk] = tokens
+            for token in tokens:
+                self._postings[token][book.pk] = self._postings[token].get(book.pk, 0) + 1
+
+    def index_many(self, book_ids):
+        if self._postings is None:
+            return
+        for book in Book.objects.filter(id__in=book_ids):
+            self.index(book)
+
+    def remove(self, book_id):
+        if self._postings is None:
+            return
+        with self._lock:
+            self._discard(book_id)
+
+    def _discard(self, book_id):
+        for token in self._documents.pop(book_id, ()):
+            self._postings[token].pop(book_id, None)
+            if not self._postings[token]:
+                del self._postings[token]
+
+    def _match(self, token):
+        scores = defaultdict(int)
+        for indexed, hits in self._postings.items():
+            if indexed.startswith(token):
+                for book_id, count in hits.items():
+                    scores[book_id] += count
+        return scores
+
+    def search(self, queryset, terms):
+        tokens = [token for term in terms for token in tokenize(term)]
+        self._ensure_built()
+        with self._lock:
+            scores = None
+            for token in tokens:
+                matched = self._match(token)
+                if scores is None:
+                    scores = matched
+                else:
+                    scores = {book_id: scores[book_id] + count for book_id, count in matched.items() if book_id in scores}
+        if not scores:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+        rank = Case(
+            *(When(id=book_id, then=Value(float(score))) for book_id, score in scores.items()),
+            default=Value(0.0),
+            output_field=FloatField(),
+        )
+        return queryset.filter(id__in=scores.keys()).annotate(search_rank=rank)
+
+
+def prefix_search(queryset, text):
+    """
+    Books whose Title, Author or ISBN starts with ``text``, for typeahead.
+    Each is a LIKE 'text%' the Title/Author indexes and the ISBN key can serve.
+    """
+    text = text.strip()
+    if not text:
+        return queryset.none()
+    return queryset.filter(Q(Title__istartswith=text) | Q(Author__istartswith=text) | Q(ISBN__istartswith=text))
+
+
+def default_backend_path():
+    if connection.vendor == 'mysql':
+        return 'Library.search.MySQLFullTextBackend'
+    if connection.vendor == 'sqlite':
+        return 'Library.search.SQLiteFTS5Backend'
+    return 'Library.search.ORMSearchBackend'
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    path = getattr(settings, 'LIBRARY_SEARCH_BACKEND', None) or default_backend_path()
+    return import_string(path)()
+
+
+class BookSearchFilter(filters.SearchFilter):
+    """
+    Drop-in replacement for SearchFilter that keeps the ``?search=`` contract
+    but answers from the configured full-text index. Results are ordered by
+    relevance unless the client asks for an explicit ``?ordering=``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not any(tokenize(term) for term in terms):
+            return queryset
+        ordering = queryset.query.order_by
+        queryset = get_search_backend().search(queryset, terms)
+        if filters.OrderingFilter.ordering_param not in request.query_params:
+            queryset = queryset.order_by('-search_rank', *ordering)
+        return queryset
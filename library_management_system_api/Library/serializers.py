@@ -1,17 +1,22 @@
 from .models import Book, User,Transactions
 from rest_framework import serializers
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from .authentication import stamp_claims
+from .metrics import TimedSerializerMixin
 
 
 
-class BookSerializer(serializers.ModelSerializer):
+class BookSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Book
         fields = '__all__'
         
         
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
@@ -34,18 +39,38 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
 
-class TransactionSerializer(serializers.ModelSerializer):
+class UserListSerializer(UserSerializer):
+    # Filled in by User.objects.with_loan_totals().
+    active_loans = serializers.IntegerField(read_only=True)
+    penalties = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
      class Meta:
         model = Transactions
         fields = ['user', 'book', 'checkout_date','return_date']
     
     
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        return stamp_claims(super().get_token(user), user)
+
     def validate(self, attrs):
         # Add custom validation for email if needed
         data = super().validate(attrs)
         data.update({'email': self.user.email})
         return data
 
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # Re-read the claims so a refreshed access token never carries stale ones.
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = User.objects.filter(id=access[api_settings.USER_ID_CLAIM], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('User not found or inactive', code='user_inactive')
+        data['access'] = str(stamp_claims(access, user))
+        return data
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
\ No newline at end of file
@@ -0,0 +1,298 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DecimalField, F, Func, IntegerField, Value
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .availability import notify_availability
+from .catalog_cache import invalidate_catalog
+from .models import Book, Transactions
+from .outbox import enqueue_email, enqueue_emails
+from .stats import record_checkouts, record_returns
+
+PENALTY_PER_DAY = Decimal('1.00')  # Example penalty calculation
+MAX_PENALTY = Decimal('999.99')  # Largest value Transactions.penalty can hold
+
+
+def penalty_per_day():
+    """LIBRARY_PENALTY_PER_DAY, the rate returns, the penalty job and the dashboard all use."""
+    return Decimal(str(getattr(settings, 'LIBRARY_PENALTY_PER_DAY', PENALTY_PER_DAY)))
+
+
+class CheckoutError(Exception):
+    pass
+
+class BookNotFound(CheckoutError):
+    pass
+
+class NoCopiesAvailable(CheckoutError):
+    pass
+
+class AlreadyCheckedOut(CheckoutError):
+    pass
+
+class NotCheckedOut(CheckoutError):
+    pass
+
+
+def _raise_unavailable(book_id):
+    # Only runs on the failure path, so a successful checkout stays at 2 queries.
+    if not Book.objects.filter(id=book_id).exists():
+        raise BookNotFound(book_id)
+    raise NoCopiesAvailable(book_id)
+
+
+def _book_pk(book_id):
+    # Ids typed into the HTML pickers or sent by API clients may not be numbers.
+    try:
+        return int(book_id)
+    except (TypeError, ValueError):
+        raise BookNotFound(book_id)
+
+
+def checkout_book(user, book_id):
+    """
+    Reserve one copy of a book and record the loan.
+
+    The copy is taken with a single conditional UPDATE, so two concurrent
+    checkouts can never push Number_of_copies_Available below zero.
+    """
+    book_id = _book_pk(book_id)
+    try:
+        with transaction.atomic():
+            reserved = Book.objects.filter(
+                id=book_id, Number_of_copies_Available__gt=0
+            ).update(Number_of_copies_Available=F('Number_of_copies_Available') - 1)
+            if not reserved:
+                _raise_unavailable(book_id)
+            checkout = Transactions.objects.create(user=user, book_id=book_id)
+            record_checkouts([checkout])
+            invalidate_catalog([book_id])
+            notify_availability([book_id])
+            return checkout
+    except IntegrityError:
+        # The loan insert failed, so the reservation above was rolled back too.
+        raise AlreadyCheckedOut(book_id)
+
+
+def checkin_book(user, book_id):
+    """
+    Close the user's open loan for a book and put the copy back on the shelf.
+    """
+    book_id = _book_pk(book_id)
+    today = timezone.now().date()
+    with transaction.atomic():
+        checkout = (
+            Transactions.objects.select_for_update(of=('self',))
+            .select_related('book')
+            .filter(user=user, book_id=book_id, return_date__isnull=True)
+            .first()
+        )
+        if checkout is None:
+            if not Book.objects.filter(id=book_id).exists():
+                raise BookNotFound(book_id)
+            raise NotCheckedOut(book_id)
+        checkout.user = user
+
+        _close_loan(checkout, today)
+        checkout.save(update_fields=['return_date', 'penalty'])
+        if overdue_days(checkout):
+            # Queued with the return so the email is sent only if it commits.
+            enqueue_email(*overdue_notice(checkout))
+
+        Book.objects.filter(id=book_id).update(
+            Number_of_copies_Available=F('Number_of_copies_Available') + 1
+        )
+        record_returns([checkout])
+        invalidate_catalog([book_id])
+        notify_availability([book_id])
+    return checkout
+
+
+def _close_loan(checkout, today):
+    checkout.return_date = today
+    if checkout.return_date > checkout.due_date:
+        checkout.penalty = min(overdue_days(checkout) * penalty_per_day(), MAX_PENALTY)
+
+
+def _normalize_keys(keys, field_name):
+    if field_name != 'id':
+        return [str(key) for key in keys]
+    normalized = []
+    for key in keys:
+        try:
+            normalized.append(int(key))
+        except (TypeError, ValueError):
+            normalized.append(None)
+    return normalized
+
+
+def bulk_checkout(user, keys, field_name='id'):
+    """
+    Check out several books for one user in a single transaction.
+
+    ``keys`` are book ids, or ISBNs when ``field_name='ISBN'``. Returns a list
+    of ``(key, result)`` pairs in request order, where ``result`` is the new
+    loan or the CheckoutError for that item. The query count does not depend
+    on the number of books.
+    """
+    lookup = _normalize_keys(keys, field_name)
+    results = []
+    with transaction.atomic():
+        books = Book.objects.select_for_update().in_bulk(
+            [key for key in lookup if key is not None], field_name=field_name
+        )
+        taken = set(
+            Transactions.objects.filter(user=user, book__in=list(books.values()), return_date__isnull=True)
+            .values_list('book_id', flat=True)
+        )
+        to_checkout = []
+        for key, lookup_key in zip(keys, lookup):
+            book = books.get(lookup_key)
+            if book is None:
+                results.append((key, BookNotFound(key)))
+            elif book.id in taken:
+                results.append((key, AlreadyCheckedOut(key)))
+            elif book.Number_of_copies_Available < 1:
+                results.append((key, NoCopiesAvailable(key)))
+            else:
+                taken.add(book.id)
+                checkout = Transactions(user=user, book=book)
+                to_checkout.append(checkout)
+                results.append((key, checkout))
+
+        if to_checkout:
+            Book.objects.filter(id__in=[checkout.book_id for checkout in to_checkout]).update(
+                Number_of_copies_Available=F('Number_of_copies_Available') - 1
+            )
+            Transactions.objects.bulk_create(to_checkout)
+            record_checkouts(to_checkout)
+            invalidate_catalog(checkout.book_id for checkout in to_checkout)
+            notify_availability(checkout.book_id for checkout in to_checkout)
+    return results
+
+
+def bulk_checkin(user, keys, field_name='id'):
+    """
+    Return several books for one user in a single transaction.
+
+    Same contract as ``bulk_checkout``; successful items carry the closed loan.
+    """
+    today = timezone.now().date()
+    lookup = _normalize_keys(keys, field_name)
+    results = []
+    with transaction.atomic():
+        books = Book.objects.in_bulk(
+            [key for key in lookup if key is not None], field_name=field_name
+        )
+        open_loans = {
+            checkout.book_id: checkout
+            for checkout in Transactions.objects.select_for_update(of=('self',))
+            .filter(user=user, book__in=list(books.values()), return_date__isnull=True)
+        }
+        returned = []
+        for key, lookup_key in zip(keys, lookup):
+            book = books.get(lookup_key)
+            if book is None:
+                results.append((key, BookNotFound(key)))
+                continue
+            checkout = open_loans.pop(book.id, None)
+            if checkout is None:
+                results.append((key, NotCheckedOut(key)))
+                continue
+            checkout.user = user
+            checkout.book = book
+            _close_loan(checkout, today)
+            returned.append(checkout)
+            results.append((key, checkout))
+
+        if returned:
+            Transactions.objects.bulk_update(returned, ['return_date', 'penalty'])
+            Book.objects.filter(id__in=[checkout.book_id for checkout in returned]).update(
+                Number_of_copies_Available=F('Number_of_copies_Available') + 1
+            )
+            record_returns(returned)
+            invalidate_catalog(checkout.book_id for checkout in returned)
+            notify_availability(checkout.book_id for checkout in returned)
+            notices = [overdue_notice(checkout) for checkout in returned if overdue_days(checkout)]
+            if notices:
+                enqueue_emails(notices)
+    return results
+
+
+class DaysBetween(Func):
+    """Whole days from the ``start`` date to the ``end`` date, computed in SQL."""
+    arity = 2
+    output_field = IntegerField()
+
+    def __init__(self, start, end, **extra):
+        super().__init__(end, start, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # PostgreSQL: subtracting dates gives whole days.
+        return super().as_sql(compiler, connection, template='(%(expressions)s)', arg_joiner=' - ', **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='DATEDIFF', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection,
+            template='CAST(julianday(%(expressions)s) AS INTEGER)', arg_joiner=') - julianday(',
+            **extra_context,
+        )
+
+
+def penalty_expression(today):
+    """An open loan's penalty on ``today``, from its due_date, as a SQL expression."""
+    penalty = DecimalField(max_digits=5, decimal_places=2)
+    days = DaysBetween(F('due_date'), Value(today))
+    return Least(days * Value(penalty_per_day()), Value(MAX_PENALTY), output_field=penalty)
+
+
+def recompute_penalties(today=None, chunk_size=5000, pause=0):
+    """
+    Bring the penalty of every overdue open loan up to date with set-based
+    UPDATEs.
+
+    The penalty is computed in SQL from each row's due date, so the
+    statement is the same size however many due dates are overdue. Chunks
+    are keyset pages of ``chunk_size`` overdue open loans, so gaps in the id
+    space cost nothing. Rows already at the right value are skipped, which
+    makes reruns cheap and the reported count the number of rows actually
+    changed. ``pause`` seconds are slept between chunks to cap the write rate.
+    """
+    today = today or timezone.now().date()
+    overdue = Transactions.objects.filter(return_date__isnull=True, due_date__lt=today)
+    penalty = penalty_expression(today)
+    touched, last = 0, 0
+    while True:
+        chunk = overdue.filter(id__gt=last)
+        # The id closing this chunk; None once fewer than chunk_size remain.
+        upper = next(iter(chunk.order_by('id').values_list('id', flat=True)[chunk_size - 1:chunk_size]), None)
+        if upper is not None:
+            chunk = chunk.filter(id__lte=upper)
+        with transaction.atomic():
+            touched += chunk.exclude(penalty=penalty).update(penalty=penalty)
+        if upper is None:
+            return touched
+        last = upper
+        if pause:
+            time.sleep(pause)
+
+
+def overdue_days(checkout):
+    end = checkout.return_date or timezone.now().date()
+    return max((end - checkout.due_date).days, 0)
+
+
+def overdue_notice(checkout):
+    user = checkout.user
+    return (
+        'Overdue Book Return',
+        f'Dear {user.username}, you have returned the book "{checkout.book.Title}" {overdue_days(checkout)} days late. Your penalty is ${checkout.penalty}.',
+        user.email,
+    )
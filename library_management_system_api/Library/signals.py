@@ -0,0 +1,27 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import forget_user
+from .availability import notify_availability
+from .catalog_cache import invalidate_catalog
+from .models import Book, User
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    get_search_backend().index(instance)
+    invalidate_catalog([instance.pk])
+    notify_availability([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    get_search_backend().remove(instance.pk)
+    invalidate_catalog([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    forget_user(instance.pk)
@@ -0,0 +1,155 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import NotSupportedError, connections, router, transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import BookDailyStats, DailyLoanStats, LoanHistory, Transactions
+
+TOP_BOOKS = 5
+TOP_BOOKS_DAYS = 7
+
+
+def _due(checkout):
+    # A loan created in this process still holds the field default, which
+    # may be a datetime; compare it the way it was saved.
+    return Transactions._meta.get_field('due_date').to_python(checkout.due_date)
+
+
+def _increment(model, key_fields, deltas):
+    """
+    Add ``deltas`` ({key tuple: {field: amount}}) to ``model``'s counter rows
+    in one INSERT ... ON CONFLICT/ON DUPLICATE KEY UPDATE, creating rows
+    that don't exist yet. Concurrent increments of the same row are safe,
+    and the statement count doesn't grow with the number of rows.
+    """
+    if not deltas:
+        return
+    connection = connections[router.db_for_write(model)]
+    if not connection.features.supports_update_conflicts:
+        raise NotSupportedError(f'{connection.vendor} cannot upsert loan statistics')
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    keys = [model._meta.get_field(name) for name in key_fields]
+    # Every counter column is written, so new rows need no database defaults.
+    counters = [field for field in model._meta.concrete_fields if not field.primary_key and field not in keys]
+    params = []
+    for key, delta in deltas.items():
+        params += [field.get_db_prep_save(value, connection) for field, value in zip(keys, key)]
+        params += [field.get_db_prep_save(delta.get(field.name, 0), connection) for field in counters]
+    columns = ', '.join(quote(field.column) for field in keys + counters)
+    row = '(' + ', '.join(['%s'] * (len(keys) + len(counters))) + ')'
+    sql = f'INSERT INTO {table} ({columns}) VALUES {", ".join([row] * len(deltas))}'
+    if connection.vendor == 'mysql':
+        sql += ' ON DUPLICATE KEY UPDATE ' + ', '.join(
+            f'{quote(field.column)} = {quote(field.column)} + VALUES({quote(field.column)})' for field in counters
+        )
+    else:
+        sql += f' ON CONFLICT ({", ".join(quote(field.column) for field in keys)}) DO UPDATE SET ' + ', '.join(
+            f'{quote(field.column)} = {table}.{quote(field.column)} + EXCLUDED.{quote(field.column)}' for field in counters
+        )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def record_checkouts(loans):
+    """Count new loans. Call inside the transaction that creates them."""
+    days, books = defaultdict(Counter), Counter()
+    for loan in loans:
+        days[(loan.checkout_date,)]['checkouts'] += 1
+        days[(_due(loan),)]['open_due'] += 1
+        books[(loan.checkout_date, loan.book_id)] += 1
+    _increment(DailyLoanStats, ('date',), days)
+    _increment(BookDailyStats, ('date', 'book'), {key: {'checkouts': count} for key, count in books.items()})
+
+
+def record_returns(loans):
+    """Count closed loans. Call inside the transaction that closes them."""
+    days = defaultdict(Counter)
+    for loan in loans:
+        days[(loan.return_date,)]['returns'] += 1
+        days[(_due(loan),)]['open_due'] -= 1
+        if loan.penalty:
+            days[(loan.return_date,)]['penalties_assessed'] += loan.penalty
+    _increment(DailyLoanStats, ('date',), days)
+
+
+def loan_stats(today=None):
+    """
+    The dashboard numbers, read from the summary tables only.
+
+    Active and overdue loans and the penalties accrued on them come from the
+    open loan count per due date, so the cost grows with the number of
+    distinct due dates still open, not with the loan history.
+    """
+    from .services import MAX_PENALTY, penalty_per_day
+
+    today = today or timezone.now().date()
+    per_day = penalty_per_day()
+    active = overdue = 0
+    outstanding = Decimal('0.00')
+    for due_date, count in DailyLoanStats.objects.filter(open_due__gt=0).values_list('date', 'open_due'):
+        active += count
+        if due_date < today:
+            overdue += count
+            outstanding += count * min((today - due_date).days * per_day, MAX_PENALTY)
+    day = (
+        DailyLoanStats.objects.filter(date=today).values('checkouts', 'returns', 'penalties_assessed').first()
+        or {'checkouts': 0, 'returns': 0, 'penalties_assessed': Decimal('0.00')}
+    )
+    top_books = (
+        BookDailyStats.objects.filter(date__gt=today - timedelta(days=TOP_BOOKS_DAYS), date__lte=today)
+        .values('book_id', 'book__Title')
+        .annotate(total=Sum('checkouts'))
+        .order_by('-total', 'book__Title')[:TOP_BOOKS]
+    )
+    return {
+        'date': today,
+        'active_loans': active,
+        'overdue_loans': overdue,
+        'penalties_outstanding': outstanding,
+        'checkouts_today': day['checkouts'],
+        'returns_today': day['returns'],
+        'penalties_assessed_today': day['penalties_assessed'],
+        'top_books': [
+            {'id': row['book_id'], 'title': row['book__Title'], 'checkouts': row['total']}
+            for row in top_books
+        ],
+    }
+
+
+def rebuild_loan_stats(batch_size=1000):
+    """
+    Recompute the summary tables from every loan, archived ones included,
+    to backfill them or repair drift. Loans made while it runs may be missed or counted twice,
+    so run it when checkouts are quiet. Returns the number of rows written.
+    """
+    loans = LoanHistory.objects.order_by()
+    days = defaultdict(Counter)
+    with transaction.atomic():
+        DailyLoanStats.objects.all().delete()
+        BookDailyStats.objects.all().delete()
+        for date, count in loans.values_list('checkout_date').annotate(count=Count('id')):
+            days[date]['checkouts'] += count
+        returned = loans.filter(return_date__isnull=False).values_list('return_date')
+        for date, count, penalties in returned.annotate(count=Count('id'), penalties=Sum('penalty')):
+            days[date]['returns'] += count
+            days[date]['penalties_assessed'] += penalties or 0
+        open_loans = loans.filter(return_date__isnull=True).values_list('due_date')
+        for date, count in open_loans.annotate(count=Count('id')):
+            days[date]['open_due'] += count
+        DailyLoanStats.objects.bulk_create(
+            [DailyLoanStats(date=date, **counts) for date, counts in days.items()], batch_size=batch_size
+        )
+        per_book = loans.values_list('checkout_date', 'book_id').annotate(count=Count('id'))
+        written = len(days)
+        batch = []
+        for date, book_id, count in per_book.iterator(chunk_size=batch_size):
+            batch.append(BookDailyStats(date=date, book_id=book_id, checkouts=count))
+            if len(batch) == batch_size:
+                BookDailyStats.objects.bulk_create(batch)
+                written, batch = written + len(batch), []
+        BookDailyStats.objects.bulk_create(batch)
+    return written + len(batch)
@@ -1,3 +1,1397 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core import mail
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router
+from django.db.backends.sqlite3 import base as sqlite3_base
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import (
+    ArchivedTransaction, Book, BookDailyStats, DailyLoanStats, LoanHistory, User, Transactions, OutboxEmail,
+)
+from .serializers import BookSerializer
+from . import metrics
+from .archive import archive_cutoff, archive_loans
+from .authentication import SESSION_HASH, USER_CACHE_FIELDS, USER_CACHE_KEY
+from .availability import CacheBroker, availability_events, get_broker
+from .fastlist import FastJSONRenderer, list_plan
+from .idempotency import LOCK_KEY, RESULT_KEY
+from .querybudget import QueryBudgetExceeded, query_budget
+from .replicas import ReplicaPinMiddleware, read_from_replica
+from .search import MySQLFullTextBackend, default_backend_path, get_search_backend
+from .stats import loan_stats, rebuild_loan_stats
+from .throttling import TokenBucket, client_ip
+from .services import (
+    checkout_book, checkin_book, bulk_checkout, bulk_checkin,
+    BookNotFound, NoCopiesAvailable, AlreadyCheckedOut, NotCheckedOut, MAX_PENALTY, PENALTY_PER_DAY,
+    recompute_penalties,
+)
+
+
+def make_user(n):
+    return User.objects.create_user(email=f'user{n}@example.com', username=f'user{n}', password='secret')
+
+
+class InventoryServiceTests(TransactionTestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=1)
+
+    def test_checkout_costs_four_queries(self):
+        # The copy, the loan, and one upsert each for the daily and per-book stats.
+        with CaptureQueriesContext(connection) as ctx:
+            checkout_book(self.user, self.book.id)
+        statements = [q['sql'] for q in ctx.captured_queries if q['sql'] not in ('BEGIN', 'COMMIT')]
+        self.assertEqual(len(statements), 4, statements)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.Number_of_copies_Available, 0)
+
+    def test_checkout_errors(self):
+        with self.assertRaises(BookNotFound):
+            checkout_book(self.user, 999)
+        checkout_book(self.user, self.book.id)
+        with self.assertRaises(NoCopiesAvailable):
+            checkout_book(make_user(1), self.book.id)
+
+    def test_duplicate_checkout_does_not_leak_a_copy(self):
+        self.book.Number_of_copies_Available = 2
+        self.book.save()
+        checkout_book(self.user, self.book.id)
+        with self.assertRaises(AlreadyCheckedOut):
+            checkout_book(self.user, self.book.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.Number_of_copies_Available, 1)
+
+    def test_reborrow_after_return(self):
+        checkout_book(self.user, self.book.id)
+        checkin_book(self.user, self.book.id)
+        checkout_book(self.user, self.book.id)
+        with self.assertRaises(IntegrityError):
+            Transactions.objects.create(user=self.user, book=self.book)
+        self.assertEqual(Transactions.objects.filter(user=self.user, book=self.book).count(), 2)
+
+    def test_checkin(self):
+        with self.assertRaises(NotCheckedOut):
+            checkin_book(self.user, self.book.id)
+        checkout_book(self.user, self.book.id)
+        checkout = checkin_book(self.user, self.book.id)
+        self.assertIsNotNone(checkout.return_date)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.Number_of_copies_Available, 1)
+
+
+class BulkCheckoutTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        self.books = [
+            Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+            for n in range(30)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_grow_with_items(self):
+        # Four statements and two stats upserts, plus the SAVEPOINT/RELEASE
+        # pair TestCase adds; returns upsert the daily stats only.
+        with self.assertNumQueries(8):
+            bulk_checkout(self.user, [book.id for book in self.books[:3]])
+        with self.assertNumQueries(8):
+            bulk_checkout(self.user, [book.id for book in self.books[3:]])
+        with self.assertNumQueries(7):
+            bulk_checkin(self.user, [book.id for book in self.books])
+        self.assertFalse(Book.objects.exclude(Number_of_copies_Available=1).exists())
+
+    def test_per_item_results(self):
+        Book.objects.filter(id=self.books[1].id).update(Number_of_copies_Available=0)
+        response = self.client.post(
+            '/bookcheckout/bulk/',
+            {'isbns': ['isbn-0', 'isbn-1', 'isbn-0', 'missing']},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['ok'], item.get('error')) for item in response.data['results']],
+            [
+                (True, None),
+                (False, 'No copies available'),
+                (False, 'You have already checked out this book'),
+                (False, 'Book not found'),
+            ],
+        )
+        response = self.client.post('/bookcheckout/bulk-return/', {'books': [self.books[0].id, self.books[1].id]}, format='json')
+        self.assertEqual([item['ok'] for item in response.data['results']], [True, False])
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        self.dune = Book.objects.create(Title='Dune', Author='Frank Herbert', ISBN='111', Number_of_copies_Available=1)
+        self.messiah = Book.objects.create(Title='Dune Messiah', Author='Frank Herbert', ISBN='222', Number_of_copies_Available=1)
+        Book.objects.create(Title='Emma', Author='Jane Austen', ISBN='333', Number_of_copies_Available=1)
+
+    def search(self, term, **params):
+        response = self.client.get('/books/', {'search': term, **params})
+        return [book['Title'] for book in response.json()['results']]
+
+    def check_backend(self):
+        self.assertEqual(self.search('herb dune'), ['Dune', 'Dune Messiah'])
+        self.assertEqual(self.search('jane'), ['Emma'])
+        self.assertEqual(self.search('messiah', ordering='-Title'), ['Dune Messiah'])
+
+        self.messiah.Title = 'Children of Dune'
+        self.messiah.save()
+        self.assertEqual(self.search('messiah'), [])
+        self.assertEqual(self.search('children'), ['Children of Dune'])
+        self.dune.delete()
+        self.assertEqual(self.search('dune'), ['Children of Dune'])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'FTS5 needs SQLite')
+    def test_fts5_backend(self):
+        self.check_backend()
+
+    @override_settings(LIBRARY_SEARCH_BACKEND='Library.search.InMemorySearchBackend')
+    def test_in_memory_backend(self):
+        get_search_backend.cache_clear()
+        self.check_backend()
+
+    @override_settings(LIBRARY_SEARCH_BACKEND='Library.search.ORMSearchBackend')
+    def test_orm_backend(self):
+        get_search_backend.cache_clear()
+        self.check_backend()
+        self.assertEqual(self.search('33'), ['Emma'])
+
+    def test_other_vendors_default_to_orm_backend(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            self.assertEqual(default_backend_path(), 'Library.search.ORMSearchBackend')
+
+    def test_mysql_leaves_unindexed_words_to_icontains(self):
+        query, fallback = MySQLFullTextBackend().split_terms(['Dune', '978-0-1', 'of', 'F', 'herbert'])
+        self.assertEqual(query, '+dune* +herbert*')
+        self.assertEqual(fallback, ['978-0-1', 'of', 'F'])
+
+
+@override_settings(LIBRARY_ENFORCE_QUERY_BUDGETS=True)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        books = [
+            Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=5)
+            for n in range(5)
+        ]
+        for n in range(5):
+            reader = make_user(n + 1)
+            for book in books:
+                Transactions.objects.create(user=reader, book=book)
+        for book in books:
+            Transactions.objects.create(user=self.user, book=book)
+        self.client.force_login(self.user)
+
+    def test_borrowing_list(self):
+        response = self.client.get('/borrowings/')
+        self.assertContains(response, 'user5')
+        self.assertContains(response, 'Book 4')
+
+    def test_borrowing_history(self):
+        self.client.get('/user/borrowing_history/')
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(api.get('/users/borrowing_history/').data['count'], 5)
+
+    def test_str_with_related(self):
+        with query_budget(1):
+            [str(checkout) for checkout in Transactions.objects.with_related()]
+
+    def test_budget_exceeded(self):
+        with self.assertRaises(AssertionError):
+            with query_budget(1):
+                [str(checkout) for checkout in Transactions.objects.all()]
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        # Duplicate titles make the id tiebreak matter.
+        for n in range(25):
+            Book.objects.create(Title=f'Title {n % 7}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+
+    def walk(self, url, params, client=None):
+        client = client or self.client
+        seen, response = [], client.get(url, params).json()
+        while True:
+            seen.extend(response['results'])
+            if not response['next']:
+                return seen, response
+            response = client.get(response['next']).json()
+
+    def test_walks_whole_catalog_in_order(self):
+        expected = list(Book.objects.order_by('-Title', 'id').values_list('id', flat=True))
+        seen, last = self.walk('/books/', {'cursor': '', 'page_size': 4, 'ordering': '-Title'})
+        self.assertEqual([book['id'] for book in seen], expected)
+        self.assertNotIn('count', last)
+
+        previous = self.client.get(last['previous']).json()
+        self.assertEqual([book['id'] for book in previous['results']], expected[-5:-1])
+
+    def test_page_number_clients_unchanged(self):
+        response = self.client.get('/books/', {'page': 2}).json()
+        self.assertEqual(response['count'], 25)
+        self.assertEqual(len(response['results']), 10)
+
+    def test_search_needs_explicit_ordering(self):
+        self.assertEqual(self.client.get('/books/', {'cursor': '', 'search': 'title'}).status_code, 400)
+        self.assertEqual(self.client.get('/books/', {'cursor': 'garbage'}).status_code, 404)
+
+    def test_borrowing_history_cursor(self):
+        for book in Book.objects.all()[:12]:
+            Transactions.objects.create(user=self.user, book=book)
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(api.get('/users/borrowing_history/').data['count'], 12)
+        seen, _ = self.walk('/users/borrowing_history/', {'cursor': '', 'page_size': 5}, client=api)
+        self.assertEqual(len(seen), 12)
+
+
+class BorrowingHistoryTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        today = timezone.now().date()
+        for n in range(15):
+            book = Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+            checkout = Transactions.objects.create(user=self.user, book=book)
+            Transactions.objects.filter(id=checkout.id).update(
+                checkout_date=today - timedelta(days=n),
+                return_date=today if n % 3 == 0 else None,
+            )
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        self.today = today
+
+    def test_api_paginates_and_filters(self):
+        data = self.api.get('/users/borrowing_history/').data
+        self.assertEqual((data['count'], len(data['results'])), (15, 10))
+        data = self.api.get('/users/borrowing_history/', {'status': 'returned'}).data
+        self.assertEqual(data['count'], 5)
+        since = (self.today - timedelta(days=4)).isoformat()
+        data = self.api.get('/users/borrowing_history/', {'from': since, 'status': 'open'}).data
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(self.api.get('/users/borrowing_history/', {'from': 'yesterday'}).status_code, 400)
+
+    def test_html_view_paginates(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/user/borrowing_history/', {'to': self.today.isoformat()})
+        self.assertEqual(response.context['page_obj'].paginator.count, 15)
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertContains(response, f'?page=2&to={self.today.isoformat()}')
+
+    def test_stream(self):
+        response = self.api.get('/users/borrowing_history/stream/', {'status': 'open'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(set(rows[0]), {'user', 'book', 'checkout_date', 'return_date'})
+        self.assertEqual(rows[0]['checkout_date'], (self.today - timedelta(days=1)).isoformat())
+        with mock.patch('Library.views.HISTORY_STREAM_CHUNK_SIZE', 3):
+            response = self.api.get('/users/borrowing_history/stream/', {'status': 'open'})
+            self.assertEqual([json.loads(line) for line in b''.join(response.streaming_content).splitlines()], rows)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=1)
+        checkout = checkout_book(self.user, self.book.id)
+        Transactions.objects.filter(id=checkout.id).update(due_date=timezone.now().date() - timedelta(days=3))
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def drain(self):
+        out = StringIO()
+        call_command('send_outbox', stdout=out)
+        return out.getvalue()
+
+    def test_overdue_return_is_queued_not_sent(self):
+        response = self.api.post('/bookcheckout/return/', {'book': self.book.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboxEmail.objects.filter(to=self.user.email).count(), 1)
+
+        self.assertIn('Sent 1 emails', self.drain())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('3 days late', mail.outbox[0].body)
+        self.assertIn('Sent 0 emails', self.drain())
+
+    def test_failed_delivery_backs_off(self):
+        checkin_book(self.user, self.book.id)
+        with mock.patch('Library.outbox.EmailMessage.send', side_effect=OSError('relay down')):
+            self.assertIn('1 failed', self.drain())
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.attempts, email.last_error, email.sent_at), (1, 'relay down', None))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+
+        # Not due yet, so the next run leaves it alone.
+        self.assertIn('Sent 0 emails, 0 failed', self.drain())
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertIn('Sent 1 emails', self.drain())
+
+    def test_rolled_back_return_queues_nothing(self):
+        with mock.patch('Library.services.Book.objects.filter', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                checkin_book(self.user, self.book.id)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+
+class PenaltyJobTests(TestCase):
+    def test_recompute_is_set_based_and_idempotent(self):
+        today = timezone.now().date()
+        user = make_user(0)
+        expected = {}
+        for n in range(12):
+            book = Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+            checkout = Transactions.objects.create(user=user, book=book)
+            overdue = n % 4  # 0 means not overdue yet
+            due_date = today - timedelta(days=overdue) if overdue else today + timedelta(days=1)
+            Transactions.objects.filter(id=checkout.id).update(due_date=due_date)
+            expected[checkout.id] = Decimal(overdue)
+        returned = Transactions.objects.order_by('id').first()
+        Transactions.objects.filter(id=returned.id).update(due_date=today - timedelta(days=9), return_date=today)
+
+        out = StringIO()
+        call_command('compute_penalties', '--chunk-size', '5', stdout=out)
+        self.assertIn('Updated penalties on 9 loans', out.getvalue())
+        for checkout in Transactions.objects.all():
+            self.assertEqual(checkout.penalty, expected[checkout.id], checkout.id)
+
+        out = StringIO()
+        call_command('compute_penalties', stdout=out)
+        self.assertIn('Updated penalties on 0 loans', out.getvalue())
+
+    def test_penalty_computed_in_sql_per_keyset_chunk(self):
+        today = timezone.now().date()
+        user = make_user(0)
+        for n, days in enumerate([1, 2, 3, 5, 2000]):
+            book = Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+            checkout = Transactions.objects.create(user=user, book=book)
+            Transactions.objects.filter(id=checkout.id).update(due_date=today - timedelta(days=days))
+        with CaptureQueriesContext(connection) as ctx, self.settings(LIBRARY_PENALTY_PER_DAY='0.50'):
+            self.assertEqual(recompute_penalties(today, chunk_size=2), 5)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 3)
+        self.assertNotIn('CASE', ''.join(updates))
+        penalties = list(Transactions.objects.order_by('id').values_list('penalty', flat=True))
+        self.assertEqual(penalties, [Decimal('0.50'), Decimal('1.00'), Decimal('1.50'), Decimal('2.50'), MAX_PENALTY])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.dune = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=2)
+        self.emma = Book.objects.create(Title='Emma', Author='Austen', ISBN='978-1', Number_of_copies_Available=2)
+
+    def copies(self, url):
+        data = self.client.get(url).json()
+        return data['Number_of_copies_Available'] if 'ISBN' in data else [book['Number_of_copies_Available'] for book in data['results']]
+
+    def test_hits_skip_the_database(self):
+        self.assertEqual(self.copies('/books/'), [2, 2])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.copies('/books/'), [2, 2])
+        self.assertEqual(self.copies('/books/?ordering=-Title'), [2, 2])
+        self.assertEqual(cache.get('library:catalog:hits'), 1)
+        self.assertEqual(cache.get('library:catalog:misses'), 2)
+
+    def test_checkout_and_edits_invalidate(self):
+        dune_url, emma_url = f'/books/{self.dune.id}/', f'/books/{self.emma.id}/'
+        for url in ('/books/', dune_url, emma_url):
+            self.copies(url)
+
+        checkout_book(self.user, self.dune.id)
+        self.assertEqual(self.copies('/books/'), [1, 2])
+        self.assertEqual(self.copies(dune_url), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.copies(emma_url), 2)
+
+        self.emma.Number_of_copies_Available = 7
+        self.emma.save()
+        self.assertEqual(self.copies(emma_url), 7)
+        self.emma.delete()
+        self.assertEqual(self.client.get(emma_url).status_code, 404)
+
+    def test_stats_endpoint_is_admin_only(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(api.get('/books/cache-stats/').status_code, 403)
+        self.user.is_admin = True
+        self.user.save()
+        self.assertEqual(set(api.get('/books/cache-stats/').data), {'hits', 'misses', 'hit_ratio'})
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.api = APIClient()
+
+    def login(self):
+        data = self.api.post('/api/token/', {'email': 'user0@example.com', 'password': 'secret'}).data
+        self.api.credentials(HTTP_AUTHORIZATION=f"Bearer {data['access']}")
+        return data
+
+    def user_selects(self, queries):
+        return [q['sql'] for q in queries if 'Library_user' in q['sql'].split(' WHERE ')[0]]
+
+    def test_token_carries_claims(self):
+        access = AccessToken(self.login()['access'])
+        self.assertEqual((access['username'], access['email'], access['is_admin']), ('user0', 'user0@example.com', False))
+
+    def test_safe_request_skips_user_lookup(self):
+        self.login()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.api.get('/users/borrowing_history/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.user_selects(ctx.captured_queries), [])
+
+    @override_settings(LIBRARY_JWT_USER_CACHE_TTL=30)
+    def test_write_requests_cache_the_user(self):
+        self.login()
+        with CaptureQueriesContext(connection) as ctx:
+            self.api.post('/bookcheckout/', {'book': 0})
+            self.api.post('/bookcheckout/', {'book': 0})
+        self.assertEqual(len(self.user_selects(ctx.captured_queries)), 1)
+        entry = cache.get(USER_CACHE_KEY.format(self.user.pk))
+        self.assertEqual(set(entry), {*USER_CACHE_FIELDS, SESSION_HASH})
+        self.assertNotIn(self.user.password, entry.values())
+
+    def test_deactivated_user_is_rejected(self):
+        self.login()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.post('/bookcheckout/', {'book': 0}).status_code, 401)
+        # Fresh claims are still trusted for reads until they age out.
+        self.assertEqual(self.api.get('/users/borrowing_history/').status_code, 200)
+        with override_settings(LIBRARY_JWT_CLAIMS_MAX_AGE=0), mock.patch('time.time', return_value=time.time() + 1):
+            self.assertEqual(self.api.get('/users/borrowing_history/').status_code, 401)
+
+    def test_refresh_restamps_claims(self):
+        refresh = self.login()['refresh']
+        self.user.username = 'renamed'
+        self.user.save()
+        access = AccessToken(self.api.post('/api/token/refresh/', {'refresh': refresh}).data['access'])
+        self.assertEqual(access['username'], 'renamed')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.post('/api/token/refresh/', {'refresh': refresh}).status_code, 401)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.clear()
+        self.user = make_user(0)
+        Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=1)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def series(self, text, prefix):
+        return [line for line in text.splitlines() if line.startswith(prefix)]
+
+    def test_records_route_queries_and_serializer_time(self):
+        self.api.get('/books/')
+        text = self.client.get('/metrics').content.decode()
+        labels = 'route="book-list",method="GET"'
+        self.assertEqual(self.series(text, f'library_http_request_duration_seconds_count{{{labels},status="200"}}'), [
+            f'library_http_request_duration_seconds_count{{{labels},status="200"}} 1',
+        ])
+        queries = self.series(text, f'library_http_request_db_queries_sum{{{labels}}}')
+        self.assertGreater(float(queries[0].split()[-1]), 0)
+        serializer = self.series(text, f'library_http_request_serializer_seconds_count{{{labels}}}')
+        self.assertEqual(serializer[0].split()[-1], '1')
+        self.assertIn('le="+Inf"', text)
+
+    def test_multiprocess_sums_worker_files(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(LIBRARY_METRICS_MULTIPROCESS_DIR=directory):
+            self.api.get('/books/')
+            other = [['library_http_request_db_queries', [['route', 'book-list'], ['method', 'GET']], [0] * 5 + [1] + [0] * 5 + [4, 1]]]
+            with open(os.path.join(directory, '1-1.json'), 'w') as f:
+                json.dump(other, f)
+            text = self.client.get('/metrics').content.decode()
+        count = self.series(text, 'library_http_request_db_queries_count{route="book-list",method="GET"}')
+        self.assertEqual(count[0].split()[-1], '2')
+
+
+class ImportBooksTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        Book.objects.create(Title='Old title', Author='Herbert', ISBN='978-0', Number_of_copies_Available=2)
+
+    def write(self, name, text):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_csv_upserts_on_isbn_and_rejects_bad_rows(self):
+        path = self.write('books.csv', (
+            'title,author,isbn,copies\n'
+            'Dune,Herbert,978-0,9\n'
+            'Emma,Austen,978-1,3\n'
+            'No copies,Nobody,978-2,\n'
+            'Negative,Nobody,978-3,-1\n'
+        ))
+        out = StringIO()
+        call_command('import_books', path, '--batch-size', '2', '--rejects', os.path.join(self.dir, 'rejects.jsonl'), stdout=out)
+        self.assertIn('Imported 2 books, rejected 2 rows', out.getvalue())
+        dune = Book.objects.get(ISBN='978-0')
+        self.assertEqual((dune.Title, dune.Number_of_copies_Available), ('Dune', 2))
+        self.assertTrue(Book.objects.filter(ISBN='978-1', Number_of_copies_Available=3).exists())
+        with open(os.path.join(self.dir, 'rejects.jsonl')) as f:
+            self.assertEqual([json.loads(line)['row'] for line in f], [3, 4])
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_jsonl_resumes_from_checkpoint(self):
+        lines = [json.dumps({'Title': f'Book {n}', 'Author': 'Anon', 'ISBN': f'isbn-{n}', 'Number_of_copies_Available': 1}) for n in range(5)]
+        path = self.write('books.jsonl', '\n'.join(lines) + '\n')
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'size': os.path.getsize(path), 'position': 3, 'imported': 3, 'rejected': 0}, f)
+        call_command('import_books', path, '--update-copies', stdout=StringIO())
+        self.assertEqual(sorted(Book.objects.filter(ISBN__startswith='isbn-').values_list('ISBN', flat=True)), ['isbn-3', 'isbn-4'])
+
+    @override_settings(LIBRARY_SEARCH_BACKEND='Library.search.InMemorySearchBackend')
+    def test_batch_bumps_each_book_once_on_commit(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        get_search_backend().search(Book.objects.all(), ['warm'])  # build the index
+        path = self.write('books.csv', 'title,author,isbn,copies\nDune,Herbert,978-0,9\nEmma,Austen,978-1,3\n')
+        with mock.patch('Library.catalog_import.bump_catalog_version') as bump:
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('import_books', path, stdout=StringIO())
+        bump.assert_called_once()
+        self.assertEqual(sorted(bump.call_args.args[0]), sorted(Book.objects.values_list('id', flat=True)))
+        found = get_search_backend().search(Book.objects.all(), ['emma'])
+        self.assertEqual([book.ISBN for book in found], ['978-1'])
+
+    def test_changed_file_needs_restart(self):
+        path = self.write('books.jsonl', '{}\n')
+        with open(f'{path}.checkpoint', 'w') as f:
+            json.dump({'size': 1, 'position': 1, 'imported': 0, 'rejected': 0}, f)
+        with self.assertRaises(CommandError):
+            call_command('import_books', path, stdout=StringIO())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.admin = make_user(0)
+        self.admin.is_admin = True
+        self.admin.save()
+        today = timezone.now().date()
+        for n in range(3):
+            book = Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+            loan = Transactions.objects.create(user=self.admin, book=book)
+            Transactions.objects.filter(id=loan.id).update(checkout_date=today - timedelta(days=n))
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+        self.today = today
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_loans_csv(self):
+        with mock.patch('Library.exports.EXPORT_CHUNK_SIZE', 2):
+            response = self.api.get('/bookcheckout/export/')
+        lines = self.content(response).splitlines()
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="loans.csv"')
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'user_id', 'username', 'email'])
+        self.assertEqual(len(lines), 4)
+        self.assertIn('user0,user0@example.com', lines[1])
+
+    def test_loans_ndjson_filtered(self):
+        since = (self.today - timedelta(days=1)).isoformat()
+        response = self.api.get('/bookcheckout/export/', {'format': 'ndjson', 'from': since})
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['isbn'] for row in rows], ['isbn-0', 'isbn-1'])
+        self.assertEqual(self.api.get('/bookcheckout/export/', {'from': 'soon'}).status_code, 400)
+
+    def test_accept_header_negotiation(self):
+        for accept in ('application/json', 'application/x-ndjson'):
+            with self.subTest(accept=accept):
+                response = self.api.get('/bookcheckout/export/', HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+                self.assertEqual(len([json.loads(line) for line in self.content(response).splitlines()]), 3)
+        response = self.api.get('/books/export/', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="books.csv"')
+        self.assertEqual(self.api.get('/bookcheckout/export/', HTTP_ACCEPT='image/png').status_code, 406)
+
+    def test_books_gzip(self):
+        response = self.api.get('/books/export/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        text = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual(len(text.splitlines()), 4)
+
+    def test_admin_only(self):
+        self.api.force_authenticate(make_user(1))
+        self.assertEqual(self.api.get('/bookcheckout/export/').status_code, 403)
+        self.assertEqual(self.api.get('/books/export/', {'format': 'ndjson'}).status_code, 403)
+
+
+class FastListTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        today = timezone.now().date()
+        for n, title in enumerate(['Dune', 'Ōkami “quoted”', 'Line\u2028separator', 'Tab\there']):
+            book = Book.objects.create(Title=title, Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=n)
+            loan = Transactions.objects.create(user=self.user, book=book)
+            Transactions.objects.filter(id=loan.id).update(return_date=today if n % 2 else None)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def both(self, url, params=None):
+        bodies = []
+        for enabled in (False, True):
+            cache.clear()
+            with override_settings(LIBRARY_FAST_LISTS=enabled):
+                response = self.api.get(url, params or {})
+            self.assertEqual(response.status_code, 200)
+            bodies.append(response.content)
+        return bodies
+
+    def test_byte_compatible(self):
+        for url, params in [
+            ('/books/', {}),
+            ('/books/', {'ordering': '-Author', 'page_size': 2}),
+            ('/books/', {'cursor': '', 'page_size': 2}),
+            ('/bookcheckout/', {}),
+            ('/bookcheckout/', {'cursor': ''}),
+            ('/users/borrowing_history/', {}),
+            ('/users/borrowing_history/', {'cursor': '', 'status': 'open'}),
+        ]:
+            with self.subTest(url=url, params=params):
+                slow, fast = self.both(url, params)
+                self.assertEqual(slow, fast)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'a': ['Ōkami', 'x\u2029y', None, 1, True], 'b': timezone.now(), 'c': Decimal('1.50'), 'd': timezone.now().date()}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_unsupported_serializer_falls_back(self):
+        class Nested(serializers.ModelSerializer):
+            book = BookSerializer()
+
+            class Meta:
+                model = Transactions
+                fields = ['book']
+
+        self.assertIsNone(list_plan(Nested))
+
+
+class CatalogPageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        for n in range(30):
+            Book.objects.create(Title=f'Title {n:02}', Author='Herbert' if n % 2 else 'Austen', ISBN=f'isbn-{n}', Number_of_copies_Available=1)
+        self.client.force_login(self.user)
+
+    def test_book_list_paginates_and_caches(self):
+        response = self.client.get('/book/', {'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 30)
+        self.assertContains(response, 'Title 29')
+        self.assertNotContains(response, 'Title 00')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/book/', {'page': 2})
+        self.assertFalse([q for q in ctx.captured_queries if 'Library_book' in q['sql']])
+        Book.objects.create(Title='Title 30', Author='New', ISBN='isbn-30', Number_of_copies_Available=1)
+        self.assertContains(self.client.get('/book/', {'page': 2}), 'Title 30')
+
+    def test_book_list_prefix_search(self):
+        response = self.client.get('/book/', {'q': 'aus'})
+        self.assertEqual(response.context['page_obj'].paginator.count, 15)
+
+    def test_typeahead(self):
+        results = self.client.get('/book/typeahead/', {'q': 'title 1'}).json()['results']
+        self.assertEqual([book['Title'] for book in results], [f'Title {n}' for n in range(10, 20)])
+        self.assertEqual(self.client.get('/book/typeahead/', {'q': 'isbn-29'}).json()['results'][0]['id'], Book.objects.get(ISBN='isbn-29').id)
+        self.assertEqual(self.client.get('/book/typeahead/', {'q': ' '}).json()['results'], [])
+
+    def test_borrow_page_does_not_list_catalog(self):
+        response = self.client.get('/borrow_book/')
+        self.assertNotContains(response, 'Title 00')
+        response = self.client.post('/borrow_book/', {'book_id': 'Dune'})
+        self.assertContains(response, 'Book not found')
+        response = self.client.post('/borrow_book/', {'book_id': str(Book.objects.get(ISBN='isbn-3').id)})
+        self.assertContains(response, 'Book borrowed successfully')
+
+
+class AvailabilityStreamTests(TransactionTestCase):
+    async def read(self, stream):
+        return (await asyncio.wait_for(anext(stream), 5)).decode()
+
+    async def test_snapshot_then_changes(self):
+        book = await Book.objects.acreate(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=1)
+        user = await sync_to_async(make_user)(0)
+        response = await self.async_client.get('/books/availability/stream/', {'books': f'{book.id},999'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertEqual(await self.read(stream), 'retry: 3000\n\n')
+            self.assertEqual(await self.read(stream), f'event: availability\ndata: {{"book": {book.id}, "available": 1}}\n\n')
+            await sync_to_async(checkout_book)(user, book.id)
+            self.assertIn('"available": 0', await self.read(stream))
+            await sync_to_async(checkin_book)(user, book.id)
+            self.assertIn('"available": 1', await self.read(stream))
+        finally:
+            await stream.aclose()
+
+    async def test_closing_unsubscribes(self):
+        events = availability_events([1])
+        await anext(events)
+        self.assertEqual(get_broker().wants([1]), [1])
+        await events.aclose()
+        self.assertEqual(get_broker().wants([1]), [])
+
+    @override_settings(LIBRARY_AVAILABILITY_POLL_INTERVAL=0.01)
+    async def test_cache_broker_crosses_processes(self):
+        cache.clear()
+        subscriber, publisher = CacheBroker(), CacheBroker()
+        subscription = subscriber.subscribe([1, 2])
+        try:
+            await asyncio.sleep(0.05)
+            await sync_to_async(publisher.publish)([{'book': 1, 'available': 3}, {'book': 5, 'available': 0}])
+            self.assertEqual(await subscription.next_events(5), [{'book': 1, 'available': 3}])
+        finally:
+            subscriber.unsubscribe(subscription)
+
+    def test_rejects_bad_requests(self):
+        self.assertEqual(self.client.get('/books/availability/stream/', {'books': '1'}).status_code, 501)
+
+    async def test_validates_books(self):
+        for books in ('', 'one', ','.join(str(n) for n in range(101))):
+            response = await self.async_client.get('/books/availability/stream/', {'books': books})
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(LIBRARY_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.user = mock.Mock(is_authenticated=True, pk=7)
+
+    def request(self, method='get'):
+        request = getattr(self.factory, method)('/')
+        request.user = self.user
+        return request
+
+    def routed(self, request):
+        @read_from_replica
+        def view(request):
+            return HttpResponse(router.db_for_read(Book))
+        return view(request).content.decode()
+
+    def test_safe_reads_use_replica(self):
+        self.assertEqual(self.routed(self.request()), 'replica')
+        self.assertEqual(self.routed(self.request('post')), 'default')
+        self.assertEqual(router.db_for_read(Book), 'default')
+        with override_settings(LIBRARY_READ_REPLICAS=[]):
+            self.assertEqual(self.routed(self.request()), 'default')
+
+    def test_transactions_stay_on_primary(self):
+        with mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertEqual(self.routed(self.request()), 'default')
+
+    def test_writers_are_pinned_to_primary(self):
+        ReplicaPinMiddleware(lambda request: HttpResponse(status=201))(self.request('post'))
+        self.assertEqual(self.routed(self.request()), 'default')
+        self.user.pk = 8
+        self.assertEqual(self.routed(self.request()), 'replica')
+        ReplicaPinMiddleware(lambda request: HttpResponse(status=400))(self.request('post'))
+        self.assertEqual(self.routed(self.request()), 'replica')
+
+    def test_streamed_chunks_use_replica(self):
+        @read_from_replica
+        def view(request):
+            return StreamingHttpResponse(router.db_for_read(Book) for _ in range(2))
+        response = view(self.request())
+        self.assertEqual(b''.join(response.streaming_content), b'replicareplica')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(router.allow_migrate('replica', 'Library'))
+        self.assertTrue(router.allow_migrate('default', 'Library'))
+
+
+@override_settings(LIBRARY_READ_REPLICAS=['replica'])
+class TwoDatabaseReplicaTests(TransactionTestCase):
+    """A real second SQLite database as the replica, lagging behind the primary."""
+
+    def setUp(self):
+        # Added after the test runner set up DATABASES, so it neither creates
+        # nor flushes it; connected before it is listed, so the test case's
+        # database guard lets it through.
+        self.tmpdir = tempfile.mkdtemp()
+        replica = sqlite3_base.DatabaseWrapper({
+            **connections['default'].settings_dict,
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(self.tmpdir, 'replica.sqlite3'),
+        }, alias='replica')
+        connections['replica'] = replica
+        with replica.schema_editor() as editor:
+            editor.create_model(Book)
+        connections.settings['replica'] = replica.settings_dict
+        self.addCleanup(self.drop_replica)
+        cache.clear()
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=2)
+        Book.objects.using('replica').create(
+            id=self.book.id, Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=2,
+        )
+
+    def drop_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(self.tmpdir)
+
+    def copies(self, url):
+        return self.client.get(url).json()
+
+    def test_uncached_reads_go_to_the_replica(self):
+        checkout_book(make_user(0), self.book.id)
+        # The replica hasn't seen the checkout yet.
+        result = self.copies('/books/batch/?isbn=978-0')['results'][0]
+        self.assertEqual(result['book']['Number_of_copies_Available'], 2)
+
+    @override_settings(LIBRARY_SEARCH_BACKEND='Library.search.ORMSearchBackend')
+    def test_uncached_lists_go_to_the_replica(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        checkout_book(make_user(0), self.book.id)
+        for params in ({'search': 'dune'}, {'available': 'true'}, {'page': 1}):
+            with self.subTest(params=params), CaptureQueriesContext(connections['replica']) as ctx:
+                results = self.client.get('/books/', params).json()['results']
+                self.assertEqual(results[0]['Number_of_copies_Available'], 2)
+                self.assertTrue(ctx.captured_queries)
+        self.assertFalse(cache.get('library:catalog:misses'))
+        self.assertEqual(self.copies('/books/')['results'][0]['Number_of_copies_Available'], 1)
+
+    def test_query_budgets_count_replica_queries(self):
+        with self.assertRaises(QueryBudgetExceeded) as raised:
+            with query_budget(0):
+                self.client.get('/books/batch/?isbn=978-0')
+        self.assertIn('[replica]', str(raised.exception))
+
+    def test_catalog_cache_is_filled_from_the_primary(self):
+        detail = f'/books/{self.book.id}/'
+        self.assertEqual(self.copies(detail)['Number_of_copies_Available'], 2)
+        checkout_book(make_user(0), self.book.id)
+        for _ in range(2):  # the miss, then the entry it stored
+            self.assertEqual(self.copies(detail)['Number_of_copies_Available'], 1)
+            self.assertEqual(self.copies('/books/')['results'][0]['Number_of_copies_Available'], 1)
+        cache.clear()
+        for _ in range(2):
+            result = self.copies(f'/books/batch/?ids={self.book.id}')['results'][0]
+            self.assertEqual(result['book']['Number_of_copies_Available'], 1)
+        self.assertEqual(self.copies(detail)['Number_of_copies_Available'], 1)
+
+
+class LoanStatsTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        self.books = [
+            Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=2)
+            for n in range(3)
+        ]
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def summaries(self):
+        return (
+            list(DailyLoanStats.objects.order_by('date').values_list('date', 'checkouts', 'returns', 'open_due', 'penalties_assessed')),
+            list(BookDailyStats.objects.order_by('date', 'book').values_list('date', 'book', 'checkouts')),
+        )
+
+    def test_counters_follow_checkouts_and_returns(self):
+        checkout_book(self.user, self.books[0].id)
+        bulk_checkout(self.user, [self.books[1].id, self.books[2].id])
+        bulk_checkout(make_user(1), [self.books[1].id])
+        later = timezone.now() + timedelta(days=17)  # three days past the due date
+        with mock.patch('Library.services.timezone.now', return_value=later):
+            checkin_book(self.user, self.books[0].id)
+
+        stats = loan_stats(today=later.date())
+        self.assertEqual(stats['active_loans'], 3)
+        self.assertEqual(stats['overdue_loans'], 3)
+        self.assertEqual(stats['penalties_outstanding'], 3 * 3 * PENALTY_PER_DAY)
+        self.assertEqual(stats['returns_today'], 1)
+        self.assertEqual(stats['penalties_assessed_today'], 3 * PENALTY_PER_DAY)
+        self.assertEqual(stats['top_books'], [])
+
+        stats = loan_stats()
+        self.assertEqual((stats['active_loans'], stats['overdue_loans'], stats['checkouts_today']), (3, 0, 4))
+        self.assertEqual(stats['top_books'][0], {'id': self.books[1].id, 'title': 'Book 1', 'checkouts': 2})
+
+    @override_settings(LIBRARY_PENALTY_PER_DAY='2.50')
+    def test_outstanding_penalties_use_the_configured_rate(self):
+        checkout = checkout_book(self.user, self.books[0].id)
+        later = Transactions.objects.get(id=checkout.id).due_date + timedelta(days=3)
+        self.assertEqual(recompute_penalties(later), 1)
+        self.assertEqual(loan_stats(today=later)['penalties_outstanding'], Decimal('7.50'))
+        self.assertEqual(Transactions.objects.get(id=checkout.id).penalty, Decimal('7.50'))
+
+    def test_rebuild_matches_incremental_counts(self):
+        bulk_checkout(self.user, [book.id for book in self.books])
+        checkin_book(self.user, self.books[0].id)
+        incremental = self.summaries()
+        out = StringIO()
+        call_command('rebuild_loan_stats', stdout=out)
+        self.assertEqual(self.summaries(), incremental)
+        self.assertIn('Wrote 5 summary rows', out.getvalue())
+
+    def test_dashboard_reads_only_summaries(self):
+        bulk_checkout(self.user, [book.id for book in self.books])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/dashboard/stats/')
+        self.assertEqual(response.json()['active_loans'], 3)
+        self.assertFalse([q for q in ctx.captured_queries if 'Library_transactions' in q['sql']])
+        response = self.client.get('/dashboard/')
+        self.assertContains(response, 'Book 0 (1)')
+
+
+@override_settings(LIBRARY_ENFORCE_QUERY_BUDGETS=True)
+class UserListTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.admin.is_admin = self.admin.is_superuser = True
+        self.admin.save()
+        self.readers = [make_user(n) for n in range(30)]
+        group = Group.objects.create(name='members')
+        books = [
+            Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=5)
+            for n in range(3)
+        ]
+        for reader in self.readers:
+            reader.groups.add(group)
+        for book in books:
+            Transactions.objects.create(user=self.readers[0], book=book)
+        Transactions.objects.create(user=self.readers[1], book=books[0], return_date=timezone.now().date(), penalty=Decimal('4.50'))
+        Transactions.objects.filter(user=self.readers[0], book=books[0]).update(penalty=Decimal('2.00'))
+        self.api = APIClient()
+        self.api.force_authenticate(self.admin)
+
+    def test_api_annotates_totals_within_budget(self):
+        for page_size in (5, 100):
+            response = self.api.get('/users/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 31)
+        totals = {row['username']: (row['active_loans'], row['penalties'], row['groups']) for row in response.data['results']}
+        group = Group.objects.get().id
+        self.assertEqual(totals['user0'], (3, '2.00', [group]))
+        self.assertEqual(totals['user1'], (0, '4.50', [group]))
+        self.assertEqual(totals['user2'], (0, '0.00', [group]))
+        response = self.api.get('/users/', {'cursor': '', 'page_size': 100})
+        self.assertEqual(len(response.data['results']), 31)
+
+    def test_api_search_and_permissions(self):
+        response = self.api.get('/users/', {'search': 'user2'})
+        self.assertEqual(sorted(row['username'] for row in response.data['results']), ['user2', 'user20', 'user21', 'user22', 'user23', 'user24', 'user25', 'user26', 'user27', 'user28', 'user29'])
+        reader = APIClient()
+        reader.force_authenticate(self.readers[0])
+        self.assertEqual(reader.get('/users/').status_code, 403)
+        self.assertEqual(reader.get(f'/users/{self.readers[0].id}/').status_code, 200)
+
+    def test_html_list(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/user/list/', {'q': 'user0@'})
+        self.assertContains(response, '<td>user0</td>')
+        self.assertContains(response, '$2.00')
+        self.assertNotContains(response, '<td>user1</td>')
+        response = self.client.get('/user/list/', {'page': 2})
+        self.assertContains(response, 'Page 2 of 2')
+
+
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=5)
+
+    def test_token_bucket_refills_over_the_period(self):
+        bucket = TokenBucket('test', 'ip', '2/10s')
+        self.assertIsNone(bucket.take('a', now=0))
+        self.assertIsNone(bucket.take('a', now=1))
+        self.assertEqual(bucket.take('a', now=2), 8)
+        self.assertIsNone(bucket.take('b', now=2))
+        # Half of the previous window has slid out: one token is back.
+        self.assertIsNone(bucket.take('a', now=15))
+        self.assertEqual(bucket.take('a', now=15), 5)
+        self.assertIsNone(bucket.take('a', now=20))
+
+    @override_settings(LIBRARY_THROTTLE_RATES={'login': {'ip': '3/m', 'user': '2/m'}})
+    def test_token_endpoint_throttled_before_authentication(self):
+        with mock.patch('rest_framework_simplejwt.serializers.authenticate', return_value=None) as authenticate:
+            codes = [
+                self.client.post('/api/token/', {'email': 'USER0@example.com', 'password': 'guess'}).status_code
+                for _ in range(3)
+            ]
+            self.assertEqual(codes, [401, 401, 429])
+            self.assertEqual(authenticate.call_count, 2)
+            response = self.client.post('/api/token/', {'email': 'other@example.com', 'password': 'guess'})
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            response = self.client.post('/api/token/', {'email': 'other@example.com', 'password': 'guess'}, REMOTE_ADDR='10.0.0.2')
+            self.assertEqual(response.status_code, 401)
+        response = self.client.get('/metrics')
+        self.assertContains(response, 'library_throttle_requests_total{scope="login",bucket="user",result="throttled"} 1')
+        self.assertContains(response, 'library_throttle_requests_total{scope="login",bucket="ip",result="throttled"} 1')
+
+    @override_settings(LIBRARY_THROTTLE_RATES={'login': {'ip': '1/m'}, 'register': {'ip': '1/m'}})
+    def test_form_views_throttled(self):
+        with mock.patch('Library.views.authenticate', return_value=None) as authenticate:
+            self.assertEqual(self.client.get('/login/').status_code, 200)
+            self.assertEqual(self.client.post('/login/', {'email': 'user0@example.com', 'password': 'x'}).status_code, 302)
+            response = self.client.post('/login/', {'email': 'user0@example.com', 'password': 'x'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(authenticate.call_count, 1)
+        form = {'email': 'new@example.com', 'username': 'new', 'password': 'pw', 'confirm_password': 'pw'}
+        self.assertEqual(self.client.post('/register/', form).status_code, 302)
+        self.assertEqual(self.client.post('/register/', {**form, 'email': 'new2@example.com', 'username': 'new2'}).status_code, 429)
+        self.assertFalse(User.objects.filter(username='new2').exists())
+
+    @override_settings(LIBRARY_THROTTLE_RATES={'register': {'ip': '1/m'}})
+    def test_spoofed_forwarded_for_shares_a_bucket(self):
+        codes = []
+        for n in range(3):
+            form = {'email': f'new{n}@example.com', 'username': f'new{n}', 'password': 'pw', 'confirm_password': 'pw'}
+            codes.append(self.client.post('/register/', form, HTTP_X_FORWARDED_FOR=f'10.9.9.{n}').status_code)
+        self.assertEqual(codes, [302, 429, 429])
+        self.assertEqual(User.objects.filter(username__startswith='new').count(), 1)
+
+    def test_forwarded_for_trusted_up_to_num_proxies(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            self.assertEqual(client_ip(request), '1.2.3.4')
+
+    @override_settings(LIBRARY_THROTTLE_RATES={'checkout': {'user': '1/m'}})
+    def test_checkout_throttled_per_user(self):
+        api = APIClient()
+        api.force_authenticate(self.user)
+        self.assertEqual(api.post('/bookcheckout/', {'book': self.book.id}).status_code, 201)
+        self.assertEqual(api.post('/bookcheckout/return/', {'book': self.book.id}).status_code, 429)
+        self.assertEqual(api.get('/bookcheckout/').status_code, 200)
+        other = APIClient()
+        other.force_authenticate(make_user(1))
+        self.assertEqual(other.post('/bookcheckout/', {'book': self.book.id}).status_code, 201)
+        self.assertEqual(Transactions.objects.count(), 2)
+
+
+class HtmlSessionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=5)
+        self.client.post('/login/', {'email': 'user0@example.com', 'password': 'secret'})
+
+    def test_pages_skip_session_and_user_rows(self):
+        self.client.get('/borrow_book/')  # caches the user row
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/borrow_book/').status_code, 200)
+            response = self.client.post('/borrow_book/', {'book_id': self.book.id})
+        self.assertContains(response, 'Book borrowed successfully')
+        touched = [q['sql'] for q in ctx.captured_queries if 'django_session' in q['sql'] or 'Library_user' in q['sql']]
+        self.assertEqual(touched, [])
+
+    def test_password_change_ends_cached_sessions(self):
+        self.assertEqual(self.client.get('/borrow_book/').status_code, 200)  # caches the user
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get('/borrow_book/').status_code, 200)
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertEqual(self.client.get('/borrow_book/').status_code, 302)
+
+    def test_session_survives_cache_loss(self):
+        cache.clear()
+        self.assertEqual(self.client.get('/borrow_book/').status_code, 200)
+
+    def test_messages_use_cookie(self):
+        self.client.post('/login/', {'email': 'user0@example.com', 'password': 'wrong'})
+        self.assertIn('messages', self.client.cookies)
+        self.assertContains(self.client.get('/login/'), 'Invalid email or password')
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.books = [
+            Book.objects.create(Title=f'Book {n}', Author='Anon', ISBN=f'isbn-{n}', Number_of_copies_Available=5)
+            for n in range(5)
+        ]
+        today = timezone.now().date()
+        for n, book in enumerate(self.books[:3]):
+            loan = Transactions.objects.create(user=self.user, book=book)
+            Transactions.objects.filter(id=loan.id).update(
+                checkout_date=today - timedelta(days=500 + n), due_date=today - timedelta(days=486 + n),
+                return_date=today - timedelta(days=480), penalty=Decimal('1.50'),
+            )
+        Transactions.objects.create(user=self.user, book=self.books[3], return_date=today)
+        Transactions.objects.create(user=self.user, book=self.books[4])
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def test_archives_old_returned_loans_in_batches(self):
+        out = StringIO()
+        call_command('archive_loans', '--batch-size', '2', stdout=out)
+        self.assertIn('Archived 3 loans', out.getvalue())
+        self.assertEqual(ArchivedTransaction.objects.count(), 3)
+        self.assertEqual(sorted(Transactions.objects.values_list('book_id', flat=True)), [self.books[3].id, self.books[4].id])
+        self.assertEqual(archive_loans(archive_cutoff()), 0)
+
+    def test_interrupted_run_resumes(self):
+        self.assertEqual(archive_loans(archive_cutoff(), batch_size=1, max_batches=2), 2)
+        self.assertEqual(LoanHistory.objects.count(), 5)
+        self.assertEqual(archive_loans(archive_cutoff(), batch_size=1), 1)
+        self.assertEqual(Transactions.objects.count(), 2)
+
+    def test_conflicting_archive_row_rolls_back_the_batch(self):
+        loan = Transactions.objects.order_by('id').first()
+        ArchivedTransaction.objects.create(
+            id=loan.id, user=self.user, book=self.books[4], checkout_date=loan.checkout_date,
+            due_date=loan.due_date, return_date=loan.return_date,
+        )
+        with self.assertRaises(IntegrityError):
+            archive_loans(archive_cutoff(), batch_size=2)
+        self.assertTrue(Transactions.objects.filter(id=loan.id).exists())
+        self.assertEqual(ArchivedTransaction.objects.count(), 1)
+
+    def test_readers_see_archived_loans(self):
+        def summaries():
+            rebuild_loan_stats()
+            return list(DailyLoanStats.objects.order_by('date').values_list('date', 'checkouts', 'returns', 'open_due', 'penalties_assessed'))
+
+        before = summaries()
+        archive_loans(archive_cutoff())
+        self.assertEqual(summaries(), before)
+        self.assertEqual(self.api.get('/users/borrowing_history/').data['count'], 5)
+        response = self.api.get('/bookcheckout/is-returned/', {'book': self.books[0].id})
+        self.assertEqual(response.data['message'], 'Book has been returned')
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get('/user/borrowing_history/'), 'Book 2')
+
+        admin = make_user('admin')
+        admin.is_admin = True
+        admin.save()
+        self.api.force_authenticate(admin)
+        response = self.api.get('/bookcheckout/export/', {'format': 'ndjson'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        totals = {row['username']: row['penalties'] for row in self.api.get('/users/').data['results']}
+        self.assertEqual(totals['user0'], '4.50')
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(0)
+        self.book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=5)
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+
+    def post(self, url, key, **data):
+        return self.api.post(url, data or {'book': self.book.id}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        first = self.post('/bookcheckout/', 'k1')
+        self.assertEqual(first.status_code, 201)
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.post('/bookcheckout/', 'k1')
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transactions.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.Number_of_copies_Available, 4)
+
+        self.assertEqual(self.post('/bookcheckout/return/', 'k2').status_code, 200)
+        retry = self.post('/bookcheckout/return/', 'k2')
+        self.assertEqual(retry.status_code, 200)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.Number_of_copies_Available, 5)
+        # Without a key every request runs.
+        self.assertEqual(self.api.post('/bookcheckout/return/', {'book': self.book.id}).status_code, 400)
+
+    def test_key_scoped_to_user_and_request(self):
+        self.assertEqual(self.post('/bookcheckout/', 'k1').status_code, 201)
+        self.assertEqual(self.post('/bookcheckout/return/', 'k1').status_code, 422)
+        other = Book.objects.create(Title='Emma', Author='Austen', ISBN='978-1', Number_of_copies_Available=1)
+        self.assertEqual(self.post('/bookcheckout/', 'k1', book=other.id).status_code, 422)
+        self.api.force_authenticate(make_user(1))
+        self.assertEqual(self.post('/bookcheckout/', 'k1').status_code, 201)
+        self.assertEqual(Transactions.objects.count(), 2)
+        self.assertEqual(self.post('/bookcheckout/', 'x' * 256).status_code, 400)
+
+    def test_response_stored_between_lookup_and_claim_is_replayed(self):
+        first = self.post('/bookcheckout/', 'k1')
+        stored = cache.get(RESULT_KEY.format(self.user.pk, hashlib.md5(b'k1').hexdigest()))
+        idempotency_cache = caches['default']
+        real_get, real_add = idempotency_cache.get, idempotency_cache.add
+        results = iter([None])  # the first request hasn't finished at the lookup...
+
+        def get(key, *args, **kwargs):
+            if key.endswith(':result'):
+                return next(results, stored)  # ...but has by the time the key is claimed
+            return real_get(key, *args, **kwargs)
+
+        with mock.patch.object(idempotency_cache, 'get', get), mock.patch('Library.views.checkout_book') as checkout:
+            retry = self.post('/bookcheckout/', 'k1')
+        checkout.assert_not_called()
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(real_get(LOCK_KEY.format(self.user.pk, hashlib.md5(b'k1').hexdigest())), None)
+
+    def test_expired_claim_taken_over_is_not_released(self):
+        lock_key = LOCK_KEY.format(self.user.pk, hashlib.md5(b'k1').hexdigest())
+
+        def slow_checkout(user, book_id):
+            # LOCK_TIMEOUT passes and another request claims the key.
+            cache.set(lock_key, 'other')
+            return checkout_book(user, book_id)
+
+        with mock.patch('Library.views.checkout_book', side_effect=slow_checkout):
+            self.assertEqual(self.post('/bookcheckout/', 'k1').status_code, 201)
+        self.assertEqual(cache.get(lock_key), 'other')
+
+    @mock.patch('Library.idempotency.fingerprint', return_value='fp')
+    def test_concurrent_duplicate_waits_for_first_response(self, fingerprint):
+        digest = hashlib.md5(b'k1').hexdigest()
+        result_key = RESULT_KEY.format(self.user.pk, digest)
+        lock_key = LOCK_KEY.format(self.user.pk, digest)
+        # Another worker holds the key and never finishes in time.
+        cache.add(lock_key, 'fp')
+        with override_settings(LIBRARY_IDEMPOTENCY_WAIT=0.2):
+            response = self.post('/bookcheckout/', 'k1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # It finishes while the duplicate waits: the duplicate gets its response.
+        def finish():
+            cache.set(result_key, ('fp', 201, {'id': 99}))
+            cache.delete(lock_key)
+        timer = threading.Timer(0.1, finish)
+        timer.start()
+        response = self.post('/bookcheckout/', 'k1')
+        timer.join()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'id': 99})
+        self.assertFalse(Transactions.objects.exists())
+
+
+class BookBatchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dune = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=2)
+        self.emma = Book.objects.create(Title='Emma', Author='Austen', ISBN='978-1', Number_of_copies_Available=3)
+
+    def batch(self, query):
+        response = self.client.get(f'/books/batch/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_ids_in_request_order_with_markers(self):
+        missing = self.emma.id + 100
+        query = f'ids={self.emma.id},{missing},{self.dune.id}&ids={self.emma.id}'
+        with self.assertNumQueries(1):
+            results = self.batch(query)
+        self.assertEqual([r['id'] for r in results], [self.emma.id, missing, self.dune.id, self.emma.id])
+        self.assertEqual([r['ok'] for r in results], [True, False, True, True])
+        self.assertEqual(results[1]['error'], 'Book not found')
+        self.assertEqual(results[2]['book']['Title'], 'Dune')
+        self.assertEqual(results[0]['book'], self.client.get(f'/books/{self.emma.id}/').json())
+
+    def test_shares_detail_cache(self):
+        self.client.get(f'/books/{self.dune.id}/')
+        with self.assertNumQueries(0):
+            self.assertTrue(self.batch(f'ids={self.dune.id}')[0]['ok'])
+        self.batch(f'ids={self.emma.id}')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(f'/books/{self.emma.id}/').json()['Number_of_copies_Available'], 3)
+
+        checkout_book(make_user(0), self.dune.id)
+        with self.assertNumQueries(1):
+            results = self.batch(f'ids={self.dune.id},{self.emma.id}')
+        self.assertEqual([r['book']['Number_of_copies_Available'] for r in results], [1, 3])
+
+    def test_isbn_lookup(self):
+        with self.assertNumQueries(1):
+            results = self.batch('isbn=978-1,nope,978-0')
+        self.assertEqual([r['isbn'] for r in results], ['978-1', 'nope', '978-0'])
+        self.assertEqual([r['book']['Title'] if r['ok'] else None for r in results], ['Emma', None, 'Dune'])
+
+    def test_rejects_bad_batches(self):
+        self.assertEqual(self.client.get('/books/batch/').status_code, 400)
+        self.assertEqual(self.client.get('/books/batch/?ids=1,x').status_code, 400)
+        ids = ','.join(str(n) for n in range(201))
+        self.assertEqual(self.client.get(f'/books/batch/?ids={ids}').status_code, 400)
+
+
+@unittest.skipIf(
+    connection.vendor == 'sqlite' and connection.is_in_memory_db(),
+    'shared-cache in-memory SQLite cannot serve concurrent writers',
+)
+class ConcurrentCheckoutTests(TransactionTestCase):
+    copies = 5
+    workers = 20
+
+    def test_many_threads_one_title(self):
+        book = Book.objects.create(Title='Dune', Author='Herbert', ISBN='978-0', Number_of_copies_Available=self.copies)
+        users = [make_user(n) for n in range(self.workers)]
+        results = []
+        barrier = threading.Barrier(self.workers)
+
+        def worker(user):
+            try:
+                barrier.wait()
+                checkout_book(user, book.id)
+                results.append('ok')
+            except NoCopiesAvailable:
+                results.append('empty')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(results.count('ok'), self.copies)
+        self.assertEqual(results.count('empty'), self.workers - self.copies)
+        self.assertEqual(book.Number_of_copies_Available, 0)
+        self.assertEqual(Transactions.objects.filter(book=book).count(), self.copies)
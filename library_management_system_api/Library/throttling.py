@@ -0,0 +1,197 @@
+import hashlib
+import math
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+RATE_RE = re.compile(r'(\d+)/(\d*)([smhd])[a-z]*')
+KINDS = ('ip', 'user')
+OUTCOMES = ('allowed', 'throttled')
+BUCKET_KEY = 'library:throttle:{}:{}:{}:{}'
+STATS_KEY = 'library:throttle:stats:{}:{}:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'LIBRARY_THROTTLE_CACHE', 'default')]
+
+
+def get_rates():
+    return getattr(settings, 'LIBRARY_THROTTLE_RATES', {})
+
+
+def parse_rate(rate):
+    """'30/m' -> (30, 60), '5/10s' -> (5, 10). Periods are s, m, h or d, optionally spelled out."""
+    match = RATE_RE.fullmatch(rate.strip())
+    if match is None:
+        raise ImproperlyConfigured(f'Invalid throttle rate {rate!r}; expected e.g. "30/m" or "5/10s"')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+def _incr(cache, key, timeout):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+class TokenBucket:
+    """
+    A bucket of ``capacity`` tokens refilled at ``capacity`` per ``period``,
+    kept in the throttle cache.
+
+    A cache offers atomic incr but no compare-and-set, so the bucket is
+    approximated with two counters: tokens taken in the current window of
+    ``period`` seconds, and in the previous one, weighted by how much of it
+    is still within the last ``period`` seconds. Taking a token is one
+    atomic incr and one get; concurrent workers can never both take the
+    last token.
+    """
+
+    def __init__(self, scope, kind, rate):
+        self.scope = scope
+        self.kind = kind
+        self.capacity, self.period = parse_rate(rate)
+
+    def key(self, ident, window):
+        # Idents can be anything a client typed; keep keys short and safe.
+        digest = hashlib.md5(str(ident).encode(), usedforsecurity=False).hexdigest()
+        return BUCKET_KEY.format(self.scope, self.kind, digest, window)
+
+    def take(self, ident, now=None):
+        """Take a token for ``ident``; None if one was left, else seconds to wait."""
+        cache = get_cache()
+        window, offset = divmod(time.time() if now is None else now, self.period)
+        key = self.key(ident, int(window))
+        taken = _incr(cache, key, 2 * self.period)
+        previous = cache.get(self.key(ident, int(window) - 1), 0)
+        if previous * (1 - offset / self.period) + taken <= self.capacity:
+            return None
+        cache.decr(key)  # a refused request takes no token
+        if taken > self.capacity or not previous:
+            return self.period - offset
+        # When enough of the previous window has slid out of the bucket.
+        return self.period * (1 - (self.capacity - taken) / previous) - offset
+
+
+def _count(scope, kind, outcome):
+    _incr(get_cache(), STATS_KEY.format(scope, kind, outcome), None)
+
+
+def client_ip(request):
+    """
+    The address the request came from. X-Forwarded-For is only read when
+    REST_FRAMEWORK['NUM_PROXIES'] says how many trusted proxies appended to
+    it, and then only the entry the outermost of them added; anything the
+    client put in front is ignored, so it can't pick a fresh bucket.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR', '')
+    num_proxies = api_settings.NUM_PROXIES
+    xff = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not num_proxies or not xff:
+        return remote_addr
+    addrs = [addr.strip() for addr in xff.split(',')]
+    return addrs[-min(num_proxies, len(addrs))]
+
+
+def check_throttle(scope, request, user=None):
+    """
+    Draw from ``scope``'s per-IP bucket and, when ``user`` is given, its
+    per-user bucket. Returns None when the request may proceed, else the
+    seconds until it could.
+    """
+    rates = get_rates().get(scope)
+    if not rates:
+        return None
+    for kind, ident in (('ip', client_ip(request)), ('user', user)):
+        rate = rates.get(kind)
+        if rate is None or ident in (None, ''):
+            continue
+        wait = TokenBucket(scope, kind, rate).take(ident)
+        _count(scope, kind, 'allowed' if wait is None else 'throttled')
+        if wait is not None:
+            return wait
+    return None
+
+
+def throttle_stats():
+    """Allowed and throttled counts per scope and bucket kind, since the cache was last cleared."""
+    keys = {
+        (scope, kind, outcome): STATS_KEY.format(scope, kind, outcome)
+        for scope in get_rates() for kind in KINDS for outcome in OUTCOMES
+    }
+    found = get_cache().get_many(list(keys.values()))
+    return {labels: found.get(key, 0) for labels, key in keys.items()}
+
+
+def render_throttle_stats():
+    """throttle_stats() as a Prometheus counter, for /metrics."""
+    name = 'library_throttle_requests_total'
+    lines = [f'# HELP {name} Requests checked against a throttle bucket.', f'# TYPE {name} counter']
+    for (scope, kind, outcome), count in sorted(throttle_stats().items()):
+        lines.append(f'{name}{{scope="{scope}",bucket="{kind}",result="{outcome}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+class BucketThrottle(BaseThrottle):
+    """DRF throttle backed by the token buckets of ``scope``."""
+    scope = None
+
+    def get_user_ident(self, request):
+        return None
+
+    def allow_request(self, request, view):
+        self.wait_seconds = check_throttle(self.scope, request, self.get_user_ident(request))
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginRateThrottle(BucketThrottle):
+    # The per-user bucket is the account being tried, so spreading attempts
+    # on one account over many addresses is throttled too.
+    scope = 'login'
+
+    def get_user_ident(self, request):
+        data = request.data
+        return str(data.get('email', '')).strip().lower() if hasattr(data, 'get') else None
+
+
+class CheckoutRateThrottle(BucketThrottle):
+    scope = 'checkout'
+
+    def get_user_ident(self, request):
+        return request.user.pk if request.user.is_authenticated else None
+
+
+def throttle_post(scope, user_field=None):
+    """
+    Throttle a form view's POSTs with ``scope``'s buckets, keying the
+    per-user bucket on the ``user_field`` form value. Over the limit, the
+    view isn't called and a 429 is returned.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method == 'POST':
+                user = request.POST.get(user_field, '').strip().lower() if user_field else None
+                wait = check_throttle(scope, request, user)
+                if wait is not None:
+                    seconds = math.ceil(wait)
+                    response = HttpResponse(f'Too many attempts. Try again in {seconds} seconds.', status=429)
+                    response['Retry-After'] = str(seconds)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapped
+    return decorator
@@ -4,7 +4,8 @@ from .views import (
     BookView, UserView, BookCheckoutView, UserBorrowingHistoryView,
     CustomTokenObtainPairView, CustomTokenRefreshView, borrowing_history_view,
     user_list, dashboard, register, login_view, logout_view, home, book_list,
-    borrow_book, return_book, check_book_status,borrowing_list
+    borrow_book, return_book, check_book_status,borrowing_list, metrics_view,
+    book_typeahead, book_availability_stream, dashboard_stats,
 )
 
 router = DefaultRouter()
@@ -13,20 +14,26 @@ router.register(r'users', UserView, basename='user')
 router.register(r'bookcheckout', BookCheckoutView, basename='bookcheckout')
 
 urlpatterns = [
+    # Must precede the router, whose users/<pk>/ and books/<pk>/ routes would otherwise match them.
+    path('users/borrowing_history/', UserBorrowingHistoryView.as_view({'get': 'borrowing_history'}), name='user_borrowing_history'),
+    path('users/borrowing_history/stream/', UserBorrowingHistoryView.as_view({'get': 'borrowing_history_stream'}), name='user_borrowing_history_stream'),
+    path('books/availability/stream/', book_availability_stream, name='book_availability_stream'),
     path('', include(router.urls)),
     path('home/', home, name='home'),
     path('user/list/', user_list, name='user_list'),
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
-    path('users/borrowing_history/', UserBorrowingHistoryView.as_view({'get': 'borrowing_history'}), name='user_borrowing_history'),
-    path('user/borrowing_history/', borrowing_history_view, name='user_borrowing_history'),
+    path('user/borrowing_history/', borrowing_history_view, name='user_borrowing_history_page'),
     path('dashboard/', dashboard, name='dashboard'),
+    path('dashboard/stats/', dashboard_stats, name='dashboard_stats'),
     path('login/', login_view, name='login'),
     path('logout/', logout_view, name='logout'),
     path('register/', register, name='register'),
     path('book/', book_list, name='book_list'),
+    path('book/typeahead/', book_typeahead, name='book_typeahead'),
     path('borrowings/', borrowing_list, name='borrowing_list'),
     path('borrow_book/', borrow_book, name='borrow_book'),
     path('return_book/', return_book, name='return_book'),
     path('check_book_status/', check_book_status, name='check_book_status'),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
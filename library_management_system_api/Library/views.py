@@ -1,14 +1,33 @@
 from django.contrib.auth.decorators import user_passes_test
 from django.shortcuts import render, redirect
-from .serializers import BookSerializer, UserSerializer, TransactionSerializer
-from .models import Book, User, Transactions
+from .serializers import (
+    BookSerializer, UserSerializer, UserListSerializer, TransactionSerializer,
+    CustomTokenObtainPairSerializer, CustomTokenRefreshSerializer,
+)
+from .models import ArchivedTransaction, Book, LoanHistory, User, Transactions
+from .authentication import ClaimsJWTAuthentication
+from .availability import availability_events
+from .catalog_cache import CachedCatalogMixin, catalog_cache_stats, catalog_count, catalog_version
+from .fastlist import FastJSONRenderer, FastListMixin, to_representation, values_for
+from .exports import BOOK_COLUMNS, EXPORT_RENDERERS, LOAN_COLUMNS, export_response
+from .idempotency import idempotent
+from .metrics import collect
+from .pagination import KeysetPagination
+from .querybudget import declare_query_budget
+from .replicas import read_from_replica
+from .search import BookSearchFilter, prefix_search
+from .stats import loan_stats
+from .throttling import CheckoutRateThrottle, LoginRateThrottle, render_throttle_stats, throttle_post
+from .services import (
+    checkout_book, checkin_book, bulk_checkout, bulk_checkin,
+    BookNotFound, NoCopiesAvailable, AlreadyCheckedOut, NotCheckedOut,
+)
 from rest_framework import viewsets, status
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.utils import timezone
 from rest_framework.decorators import action
 from rest_framework import filters
-from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework.pagination import PageNumberPagination
 from django.core.mail import send_mail
@@ -16,8 +35,16 @@ from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.db.models import Q
 from django.contrib import messages
-from django.db import IntegrityError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.views.decorators.gzip import gzip_page
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+import json
 
 # Create your views here.
 class BookPagination(PageNumberPagination):
@@ -25,15 +52,143 @@ class BookPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
-class BookView(viewsets.ModelViewSet):
+class BookCursorPagination(KeysetPagination):
+    fallback_class = BookPagination
+
+class UserPageNumberPagination(PageNumberPagination):
+    page_size = 25
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = 25
+    fallback_class = UserPageNumberPagination
+
+class BorrowingHistoryPageNumberPagination(PageNumberPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class BorrowingHistoryPagination(KeysetPagination):
+    ordering = ('-checkout_date', '-id')
+    fallback_class = BorrowingHistoryPageNumberPagination
+
+HISTORY_STREAM_CHUNK_SIZE = 2000
+
+def filter_borrowing_history(borrowings, params):
+    """
+    Apply ?from= and ?to= (inclusive checkout dates, YYYY-MM-DD) and
+    ?status=open|returned in SQL. Raises ValueError on a malformed value.
+    """
+    for param, lookup in (('from', 'checkout_date__gte'), ('to', 'checkout_date__lte')):
+        value = params.get(param)
+        if value:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError(f'"{param}" must be a date in YYYY-MM-DD format')
+            borrowings = borrowings.filter(**{lookup: date})
+    state = params.get('status')
+    if state == 'open':
+        borrowings = borrowings.filter(return_date__isnull=True)
+    elif state == 'returned':
+        borrowings = borrowings.filter(return_date__isnull=False)
+    elif state:
+        raise ValueError('"status" must be "open" or "returned"')
+    return borrowings.order_by('-checkout_date', '-id')
+
+MAX_BULK_ITEMS = 100
+MAX_BATCH_BOOKS = 200
+
+MAX_STREAM_BOOKS = 100
+
+BOOK_LIST_PAGE_SIZE = 25
+USER_LIST_PAGE_SIZE = 25
+TYPEAHEAD_LIMIT = 10
+
+CHECKOUT_ERROR_MESSAGES = {
+    BookNotFound: "Book not found",
+    NoCopiesAvailable: "No copies available",
+    AlreadyCheckedOut: "You have already checked out this book",
+    NotCheckedOut: "You have not checked out this book",
+}
+
+# List and retrieve are served from the catalog cache, whose misses read the
+# primary; uncached lists (searches, filters, later pages) read a replica
+# (see CachedCatalogMixin).
+class BookView(CachedCatalogMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    filter_backends = [filters.OrderingFilter, BookSearchFilter]
     search_fields = ['Title', 'Author', 'ISBN']
     ordering_fields = ['Title', 'Author', 'ISBN']
     ordering = ['Title']
-    authentication_classes = [JWTAuthentication]
-    pagination_class = BookPagination
+    authentication_classes = [ClaimsJWTAuthentication]
+    pagination_class = BookCursorPagination
+
+    @action(detail=False, methods=['get'])
+    @method_decorator(read_from_replica)
+    @declare_query_budget(1)
+    def batch(self, request):
+        # Many books in one request: ?ids=3,1,2 or ?isbn=978-0,978-1 (either
+        # may also be repeated). Results come back in request order, with
+        # {"ok": false} for keys that match no book. Books looked up by id
+        # share the detail pages' cache entries; the rest, and any ISBN
+        # lookup, are read in one query.
+        param = 'isbn' if 'isbn' in request.query_params else 'ids'
+        keys = [key.strip() for value in request.query_params.getlist(param) for key in value.split(',') if key.strip()]
+        if not keys:
+            return Response({"error": "Provide ids or isbn"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(keys) > MAX_BATCH_BOOKS:
+            return Response({"error": f"At most {MAX_BATCH_BOOKS} books per request"}, status=status.HTTP_400_BAD_REQUEST)
+
+        def serialize(books):
+            return {book.pk: data for book, data in zip(books, self.get_serializer(books, many=True).data)}
+
+        if param == 'isbn':
+            field = 'isbn'
+            found = Book.objects.in_bulk(keys, field_name='ISBN')
+            books = serialize(list(found.values()))
+            key_ids = {key: found[key].pk for key in keys if key in found}
+        else:
+            field = 'id'
+            try:
+                keys = [int(key) for key in keys]
+            except ValueError:
+                return Response({"error": "ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+            key_ids = {key: key for key in keys}
+            books = self.cached_books(
+                request, list(dict.fromkeys(keys)), lambda missing: serialize(list(Book.objects.in_bulk(missing).values()))
+            )
+        results = []
+        for key in keys:
+            book = books.get(key_ids.get(key))
+            if book is None:
+                results.append({field: key, "ok": False, "error": "Book not found"})
+            else:
+                results.append({field: key, "ok": True, "book": book})
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[IsAdminUser])
+    def cache_stats(self, request):
+        return Response(catalog_cache_stats(), status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], renderer_classes=EXPORT_RENDERERS)
+    @method_decorator(gzip_page)
+    @method_decorator(read_from_replica)
+    def export(self, request):
+        # Inventory as CSV or NDJSON (?format=), optionally limited to books
+        # published between ?from= and ?to=.
+        books = Book.objects.all()
+        for param, lookup in (('from', 'Published_date__gte'), ('to', 'Published_date__lte')):
+            value = request.query_params.get(param)
+            if value:
+                date = parse_date(value)
+                if date is None:
+                    raise ValidationError({"error": f'"{param}" must be a date in YYYY-MM-DD format'})
+                books = books.filter(**{lookup: date})
+        return export_response([books], BOOK_COLUMNS, request.accepted_renderer.format, 'books')
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -49,69 +204,117 @@ class UserView(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
+    filter_backends = [filters.SearchFilter]
+    # Prefix matches, which the unique indexes on both columns can serve.
+    search_fields = ['^username', '^email']
+    pagination_class = UserPagination
+
+    def get_permissions(self):
+        # The list carries every user's loan and penalty totals.
+        if self.action == 'list':
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # groups and user_permissions are serialized too; prefetching
+            # them costs two queries per page instead of two per user.
+            queryset = queryset.with_loan_totals().prefetch_related('groups', 'user_permissions').order_by('id')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserListSerializer
+        return super().get_serializer_class()
 
-class BookCheckoutView(viewsets.ModelViewSet):
+    @declare_query_budget(4)
+    def list(self, request, *args, **kwargs):
+        # COUNT, the page, and the two prefetches, whatever the page size.
+        return super().list(request, *args, **kwargs)
+
+class BookCheckoutView(FastListMixin, viewsets.ModelViewSet):
     queryset = Transactions.objects.all()
     serializer_class = TransactionSerializer
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
     permission_classes = [IsAuthenticated]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
+    pagination_class = KeysetPagination
+
+    def get_throttles(self):
+        if self.action in ('create', 'return_book', 'bulk', 'bulk_return'):
+            return [CheckoutRateThrottle()]
+        return super().get_throttles()
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         user = request.user
         book_id = request.data.get('book')
         try:
-            book = Book.objects.get(id=book_id)
-        except Book.DoesNotExist:
+            checkout = checkout_book(user, book_id)
+        except BookNotFound:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        if book.Number_of_copies_Available < 1:
+        except NoCopiesAvailable:
             return Response({"error": "No copies available"}, status=status.HTTP_400_BAD_REQUEST)
-
-        if Transactions.objects.filter(user=user, book=book).exists():
+        except AlreadyCheckedOut:
             return Response({"error": "You have already checked out this book"}, status=status.HTTP_400_BAD_REQUEST)
 
-        book.Number_of_copies_Available -= 1
-        book.save()
-
-        checkout = Transactions.objects.create(user=user, book=book)
         serializer = self.get_serializer(checkout)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=False, methods=['post'], url_path='return')
+    @idempotent
     def return_book(self, request):
         user = request.user
         book_id = request.data.get('book')
         try:
-            book = Book.objects.get(id=book_id)
-        except Book.DoesNotExist:
+            checkout = checkin_book(user, book_id)
+        except BookNotFound:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
-
-        checkout = Transactions.objects.filter(user=user, book=book, return_date__isnull=True).first()
-
-        if not checkout:
+        except NotCheckedOut:
             return Response({"error": "You have not checked out this book"}, status=status.HTTP_400_BAD_REQUEST)
 
-        checkout.return_date = timezone.now().date()
-
-        if checkout.return_date > checkout.due_date:
-            overdue_days = (checkout.return_date - checkout.due_date).days
-            checkout.penalty = overdue_days * 1.00  # Example penalty calculation
-            send_mail(
-                'Overdue Book Return',
-                f'Dear {user.username}, you have returned the book "{book.Title}" {overdue_days} days late. Your penalty is ${checkout.penalty}.',
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-        checkout.save()
-
-        book.Number_of_copies_Available += 1
-        book.save()
-
         serializer = self.get_serializer(checkout)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def _bulk_keys(self, request):
+        # Accepts {"books": [ids]} or {"isbns": [ISBNs]}.
+        if 'isbns' in request.data:
+            keys, field_name = request.data.get('isbns'), 'ISBN'
+        else:
+            keys, field_name = request.data.get('books'), 'id'
+        if not isinstance(keys, list) or not keys:
+            return None, None, Response({"error": "Provide a non-empty list of books or isbns"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(keys) > MAX_BULK_ITEMS:
+            return None, None, Response({"error": f"At most {MAX_BULK_ITEMS} books per request"}, status=status.HTTP_400_BAD_REQUEST)
+        return keys, field_name, None
+
+    def _bulk_response(self, results):
+        items = []
+        for key, result in results:
+            if isinstance(result, Transactions):
+                items.append({"book": key, "ok": True, "transaction": self.get_serializer(result).data})
+            else:
+                items.append({"book": key, "ok": False, "error": CHECKOUT_ERROR_MESSAGES[type(result)]})
+        return Response({"results": items}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    @idempotent
+    def bulk(self, request):
+        keys, field_name, error = self._bulk_keys(request)
+        if error:
+            return error
+        return self._bulk_response(bulk_checkout(request.user, keys, field_name))
+
+    @action(detail=False, methods=['post'], url_path='bulk-return')
+    @idempotent
+    def bulk_return(self, request):
+        keys, field_name, error = self._bulk_keys(request)
+        if error:
+            return error
+        return self._bulk_response(bulk_checkin(request.user, keys, field_name))
+
     @action(detail=False, methods=['get'], url_path='is-returned')
     def is_returned(self, request):
         user = request.user
@@ -121,7 +324,7 @@ class BookCheckoutView(viewsets.ModelViewSet):
         except Book.DoesNotExist:
             return Response({"error": "Book not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        checkout = Transactions.objects.filter(user=user, book=book).first()
+        checkout = LoanHistory.objects.filter(user=user, book=book).order_by('-id').first()  # latest loan
 
         if not checkout:
             return Response({"error": "You have not checked out this book"}, status=status.HTTP_400_BAD_REQUEST)
@@ -131,44 +334,121 @@ class BookCheckoutView(viewsets.ModelViewSet):
         else:
             return Response({"message": "Book has not been returned"}, status=status.HTTP_200_OK)
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser], renderer_classes=EXPORT_RENDERERS)
+    @method_decorator(gzip_page)
+    @method_decorator(read_from_replica)
+    def export(self, request):
+        # The whole loan ledger with user and book details, filtered like the
+        # borrowing history (?from=, ?to=, ?status=): archived loans, then
+        # live ones, each table read on its own primary key.
+        try:
+            loans = [
+                filter_borrowing_history(model.objects.all(), request.query_params)
+                for model in (ArchivedTransaction, Transactions)
+            ]
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
+        return export_response(loans, LOAN_COLUMNS, request.accepted_renderer.format, 'loans')
+
 class UserBorrowingHistoryView(viewsets.ViewSet):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [ClaimsJWTAuthentication]
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def _history(self, request):
+        try:
+            return filter_borrowing_history(LoanHistory.objects.filter(user=request.user), request.query_params)
+        except ValueError as e:
+            raise ValidationError({"error": str(e)})
 
     @action(detail=False, methods=['get'], url_path='borrowing-history')
+    @method_decorator(read_from_replica)
+    @declare_query_budget(2)
     def borrowing_history(self, request):
-        user = request.user
-        borrowings = Transactions.objects.filter(user=user)
-        serializer = TransactionSerializer(borrowings, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        borrowings = self._history(request)
+        paginator = BorrowingHistoryPagination()
+        rows = values_for(borrowings, TransactionSerializer)
+        if rows is None:
+            page = paginator.paginate_queryset(borrowings, request, view=self)
+            return paginator.get_paginated_response(TransactionSerializer(page, many=True).data)
+        page = paginator.paginate_queryset(rows, request, view=self)
+        return paginator.get_paginated_response(to_representation(page, TransactionSerializer))
+
+    @action(detail=False, methods=['get'], url_path='borrowing-history/stream')
+    @method_decorator(read_from_replica)
+    def borrowing_history_stream(self, request):
+        # One JSON object per line, newest first. MySQLdb buffers a whole
+        # result set on the client even under .iterator(), so the history is
+        # read in keyset pages on (checkout_date, id) instead, which keeps
+        # memory flat however long it is.
+        history = self._history(request)
+        fields = ('id', 'user', 'book', 'checkout_date', 'return_date')
+
+        def lines():
+            page = history
+            while True:
+                rows = list(page.values(*fields)[:HISTORY_STREAM_CHUNK_SIZE])
+                for row in rows:
+                    last_id = row.pop('id')
+                    yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+                if len(rows) < HISTORY_STREAM_CHUNK_SIZE:
+                    return
+                last_date = rows[-1]['checkout_date']
+                page = history.filter(Q(checkout_date__lt=last_date) | Q(checkout_date=last_date, id__lt=last_id))
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
 
 @login_required
+@read_from_replica
+@declare_query_budget(2)
 def borrowing_history_view(request):
     user = request.user
-    borrowings = Transactions.objects.filter(user=user)
+    borrowings = LoanHistory.objects.filter(user=user).select_related('book')
+    try:
+        borrowings = filter_borrowing_history(borrowings, request.GET)
+    except ValueError as e:
+        messages.error(request, str(e))
+        borrowings = borrowings.order_by('-checkout_date', '-id')
     paginator = Paginator(borrowings, 10)  # Show 10 transactions per page
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
-    return render(request, 'borrowing_history.html', {'transactions': borrowings})
+    filters = request.GET.copy()
+    filters.pop('page', None)
+    return render(request, 'borrowing_history.html', {'page_obj': page_obj, 'filters': filters.urlencode()})
 
 class CustomTokenObtainPairView(TokenObtainPairView):
-    pass
+    serializer_class = CustomTokenObtainPairSerializer
+    throttle_classes = [LoginRateThrottle]
 
 class CustomTokenRefreshView(TokenRefreshView):
-    pass
+    serializer_class = CustomTokenRefreshSerializer
 
 def is_admin(user):
     return user.is_superuser
 
 @user_passes_test(is_admin)
+@read_from_replica
+@declare_query_budget(2)
 def user_list(request):
-    users = User.objects.all()
-    return render(request, 'users.html', {'users': users})
+    q = request.GET.get('q', '').strip()
+    users = User.objects.with_loan_totals().order_by('id')
+    if q:
+        users = users.filter(Q(username__istartswith=q) | Q(email__istartswith=q))
+    page_obj = Paginator(users, USER_LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+    filters = request.GET.copy()
+    filters.pop('page', None)
+    return render(request, 'users.html', {'page_obj': page_obj, 'q': q, 'filters': filters.urlencode()})
 
 @login_required
 def dashboard(request):
-    return render(request, 'dashboard.html')
+    return render(request, 'dashboard.html', {'stats': loan_stats()})
+
+@login_required
+def dashboard_stats(request):
+    # Reads the summary tables kept by Library.stats, never Transactions.
+    return JsonResponse(loan_stats())
 
+@throttle_post('register', 'email')
 def register(request):
     if request.method == 'POST':
         email = request.POST.get('email')
@@ -190,6 +470,7 @@ def register(request):
     else:
         return render(request, 'register.html')
     
+@throttle_post('login', 'email')
 def login_view(request):
     
     if request.method == 'POST':
@@ -216,8 +497,31 @@ def home(request):
 
 @login_required  
 def book_list(request):
-    books = Book.objects.all()
-    return render(request, 'books.html', {'books': books})
+    q = request.GET.get('q', '').strip()
+    books = Book.objects.order_by('Title', 'id')
+    if q:
+        books = prefix_search(books, q)
+    paginator = Paginator(books, BOOK_LIST_PAGE_SIZE)
+    # Counting is the one query that grows with the catalog; it only changes
+    # when the catalog does, so it is cached under the catalog version.
+    paginator.count = catalog_count(books, f'book_list:{q}')
+    page_obj = paginator.get_page(request.GET.get('page'))
+    filters = request.GET.copy()
+    filters.pop('page', None)
+    return render(request, 'books.html', {
+        'page_obj': page_obj,
+        'q': q,
+        'filters': filters.urlencode(),
+        'catalog_version': catalog_version(),
+        'cache_timeout': getattr(settings, 'LIBRARY_CATALOG_CACHE_TIMEOUT', 300),
+    })
+
+@login_required
+def book_typeahead(request):
+    # Prefix matches on Title, Author or ISBN for the HTML book pickers.
+    books = prefix_search(Book.objects.order_by('Title', 'id'), request.GET.get('q', ''))
+    fields = ('id', 'Title', 'Author', 'ISBN', 'Number_of_copies_Available')
+    return JsonResponse({'results': list(books.values(*fields)[:TYPEAHEAD_LIMIT])})
 
 @login_required
 def book_detail(request, book_id):
@@ -232,32 +536,30 @@ def user_detail(request, user_id):
 @login_required
 def borrowing_history(request, user_id):
     user = User.objects.get(id=user_id)
-    borrowings = Transactions.objects.filter(user=user)
+    borrowings = Transactions.objects.filter(user=user).with_related()
     return render(request, 'borrowings.html', {'borrowings': borrowings})
 
 @login_required
 def borrowing_detail(request, borrowing_id):
-    borrowing = Transactions.objects.get(id=borrowing_id)
+    borrowing = Transactions.objects.with_related().get(id=borrowing_id)
     return render(request, 'borrowing.html', {'borrowing': borrowing})
 
 @login_required
 def borrowing_return(request, borrowing_id):
-    borrowing = Transactions.objects.get(id=borrowing_id)
+    borrowing = Transactions.objects.with_related().get(id=borrowing_id)
     borrowing.return_date = timezone.now().date()
     borrowing.save()
     return render(request, 'borrowing.html', {'borrowing': borrowing})
 
 @login_required
 def borrowing_penalty(request, borrowing_id):
-    borrowing = Transactions.objects.get(id=borrowing_id)
-    overdue_days = (timezone.now().date() - borrowing.due_date).days
-    borrowing.penalty = overdue_days * 1.00  # Example penalty calculation
-    borrowing.save()
+    # Penalties are kept current by the compute_penalties job.
+    borrowing = Transactions.objects.with_related().get(id=borrowing_id)
     return render(request, 'borrowing.html', {'borrowing': borrowing})
 
 @login_required
 def borrowing_email(request, borrowing_id):
-    borrowing = Transactions.objects.get(id=borrowing_id)
+    borrowing = Transactions.objects.with_related().get(id=borrowing_id)
     send_mail(
         'Overdue Book Return',
         f'Dear {borrowing.user.username}, you have returned the book "{borrowing.book.Title}" {borrowing.penalty} days late. Your penalty is ${borrowing.penalty}.',
@@ -269,112 +571,100 @@ def borrowing_email(request, borrowing_id):
 
 @login_required
 def borrowing_is_returned(request, borrowing_id):
-    borrowing = Transactions.objects.get(id=borrowing_id)
+    borrowing = Transactions.objects.with_related().get(id=borrowing_id)
     if borrowing.return_date is not None:
         return render(request, 'borrowing.html', {'borrowing': borrowing, 'message': 'Book has been returned'})
     else:
         return render(request, 'borrowing.html', {'borrowing': borrowing, 'message': 'Book has not been returned'})
 
 @login_required
+@read_from_replica
+@declare_query_budget(1)
 def borrowing_list(request):
-    borrowings = Transactions.objects.all()
+    borrowings = Transactions.objects.with_related()
     return render(request, 'borrowings.html', {'borrowings': borrowings})
 
 @login_required
 def borrow_book(request):
     user = request.user
-    books = Book.objects.all()
     if request.method == 'POST':
         book_id = request.POST.get('book_id')
         try:
-            book = Book.objects.get(id=book_id)
-        except Book.DoesNotExist:
+            checkout_book(user, book_id)
+            messages.success(request, 'Book borrowed successfully')
+        except BookNotFound:
             messages.error(request, 'Book not found')
-            return render(request, 'borrow_book.html', {'books': books})
-
-        if book.Number_of_copies_Available < 1:
+        except NoCopiesAvailable:
             messages.error(request, 'No copies available')
-            return render(request, 'borrow_book.html', {'books': books})
-
-        if Transactions.objects.filter(user=user, book=book, return_date__isnull=True).exists():
-            messages.error(request, 'You have already borrowed this book and have not returned it yet. You cannot borrow it twice.')
-            return render(request, 'borrow_book.html', {'books': books})
-
-        book.Number_of_copies_Available -= 1
-        book.save()
-        
-        try:
-            Transactions.objects.create(user=user, book=book)
-            messages.success(request, 'Book borrowed successfully')
-        except IntegrityError:
+        except AlreadyCheckedOut:
             messages.error(request, 'You have already borrowed this book and have not returned it yet. You cannot borrow it twice.')
-        return render(request, 'borrow_book.html', {'books': books})
+        return render(request, 'borrow_book.html')
     else:
-        return render(request, 'borrow_book.html', {'books': books})
+        return render(request, 'borrow_book.html')
 
 @login_required
 def return_book(request):
     user = request.user
-    books = Book.objects.all()
     if request.method == 'POST':
         book_id = request.POST.get('book_id')
         try:
-            book = Book.objects.get(id=book_id)
-        except Book.DoesNotExist:
+            checkout = checkin_book(user, book_id)
+        except BookNotFound:
             messages.error(request, 'Book not found')
-            return render(request, 'borrow_book.html', {'books': books})
-
-        checkout = Transactions.objects.filter(user=user, book=book, return_date__isnull=True).first()
-
-        if not checkout:
+            return render(request, 'borrow_book.html')
+        except NotCheckedOut:
             messages.error(request, 'You have not checked out this book')
-            return render(request, 'borrow_book.html', {'books': books})
-
-        checkout.return_date = timezone.now().date()
-        
-        if checkout.return_date > checkout.due_date:
-            overdue_days = (checkout.return_date - checkout.due_date).days
-            checkout.penalty = overdue_days * 1.00  # Example penalty calculation
-            send_mail(
-                'Overdue Book Return',
-                f'Dear {user.username}, you have returned the book "{book.Title}" {overdue_days} days late. Your penalty is ${checkout.penalty}.',
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-        checkout.save()
-
-        book.Number_of_copies_Available += 1
-        book.save()
+            return render(request, 'borrow_book.html')
 
         messages.success(request, 'Book returned successfully')
-        return render(request, 'borrow_book.html', {'books': books})
+        return render(request, 'borrow_book.html')
     else:
-        return render(request, 'borrow_book.html', {'books': books})
+        return render(request, 'borrow_book.html')
         
 @login_required
 def check_book_status(request):
     user = request.user
-    books = Book.objects.all()
     if request.method == 'GET':
         book_id = request.GET.get('book_id')
         try:
             book = Book.objects.get(id=book_id)
-        except Book.DoesNotExist:
+        except (Book.DoesNotExist, ValueError):
             messages.error(request, 'Book not found')
-            return render(request, 'borrow_book.html', {'books': books})
+            return render(request, 'borrow_book.html')
 
-        checkout = Transactions.objects.filter(user=user, book=book).first()
+        checkout = LoanHistory.objects.filter(user=user, book=book).order_by('-id').first()  # latest loan
 
         if not checkout:
             messages.error(request, 'You have not checked out this book')
-            return render(request, 'borrow_book.html', {'books': books})
+            return render(request, 'borrow_book.html')
 
         if checkout.return_date is not None:
             messages.success(request, 'Book has been returned')
             
         else:
             messages.info(request, 'Book has not been returned')
-        return render(request, 'borrow_book.html', {'books': books})
+        return render(request, 'borrow_book.html')
     else:
-        return render(request, 'borrow_book.html', {'books': books})          
+        return render(request, 'borrow_book.html')          
+
+
+def metrics_view(request):
+    return HttpResponse(collect() + render_throttle_stats(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def book_availability_stream(request):
+    # Server-sent availability events for ?books=1,2,3, replacing polling of
+    # is-returned and check_book_status. Needs the ASGI server (asgi.py): a
+    # WSGI worker would hold a thread for as long as the stream is open.
+    if not hasattr(request, 'scope'):
+        return JsonResponse({"error": "This stream is only served over ASGI"}, status=501)
+    try:
+        book_ids = sorted({int(value) for value in request.GET.get('books', '').split(',') if value.strip()})
+    except ValueError:
+        return JsonResponse({"error": '"books" must be a comma-separated list of book ids'}, status=400)
+    if not book_ids or len(book_ids) > MAX_STREAM_BOOKS:
+        return JsonResponse({"error": f"Subscribe to between 1 and {MAX_STREAM_BOOKS} books"}, status=400)
+    response = StreamingHttpResponse(availability_events(book_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
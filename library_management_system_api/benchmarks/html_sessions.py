@@ -0,0 +1,107 @@
+"""
+Count the database round trips of each step of the HTML borrowing flow,
+with the previous settings (database sessions, Django's default message
+storage) and with the configured ones (cached sessions, cached session user,
+cookie messages):
+
+    python benchmarks/html_sessions.py
+
+Runs against a scratch SQLite database. Each step is run once to warm the
+caches, then counted.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_sytem_api.settings')
+
+BEFORE = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    return parser.parse_args()
+
+
+def setup():
+    import django
+    from django.conf import settings
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}}
+    settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    settings.LIBRARY_THROTTLE_RATES = {}
+    settings.ALLOWED_HOSTS = ['*']
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def steps(book_id):
+    # (name, method, url, data, request undoing the step's write)
+    return [
+        ('GET  borrow_book', 'get', '/borrow_book/', {}, None),
+        ('POST borrow_book', 'post', '/borrow_book/', {'book_id': book_id}, '/return_book/'),
+        ('GET  check_book_status', 'get', '/check_book_status/', {'book_id': book_id}, None),
+        ('POST return_book', 'post', '/return_book/', {'book_id': book_id}, '/borrow_book/'),
+        ('GET  dashboard', 'get', '/dashboard/', {}, None),
+    ]
+
+
+def run_flow(book_id):
+    """{step: (queries, session and user queries)} for one logged-in client."""
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    cache.clear()
+    client = Client()
+    client.post('/login/', {'email': 'bench@example.com', 'password': 'bench'})
+    counts = {}
+    for name, method, url, data, undo in steps(book_id):
+        getattr(client, method)(url, data)  # warm up
+        if undo:
+            client.post(undo, data)
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(client, method)(url, data)
+        assert response.status_code == 200, (name, response.status_code)
+        sql = [q['sql'] for q in ctx.captured_queries]
+        overhead = [s for s in sql if 'django_session' in s or 'FROM "Library_user"' in s]
+        counts[name] = (len(sql), len(overhead))
+    return counts
+
+
+def main():
+    parse_args()
+    setup()
+    from django.test.utils import override_settings
+
+    from Library.models import Book, User
+
+    User.objects.create_user(email='bench@example.com', username='bench', password='bench')
+    book = Book.objects.create(Title='Bench', Author='Bench', ISBN='bench-0', Number_of_copies_Available=5)
+
+    with override_settings(**BEFORE):
+        before = run_flow(book.id)
+    after = run_flow(book.id)
+
+    print(f'{"step":24} {"before":>14} {"after":>14}')
+    print(f'{"":24} {"total session":>14} {"total session":>14}')
+    for name in before:
+        (b_total, b_session), (a_total, a_session) = before[name], after[name]
+        print(f'{name:24} {b_total:6} {b_session:7} {a_total:6} {a_session:7}')
+    print(f'{"all steps":24} {sum(t for t, _ in before.values()):6} {sum(s for _, s in before.values()):7}'
+          f' {sum(t for t, _ in after.values()):6} {sum(s for _, s in after.values()):7}')
+    print('\n"session" counts django_session and session-user queries.')
+
+
+if __name__ == '__main__':
+    main()
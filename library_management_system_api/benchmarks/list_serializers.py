@@ -0,0 +1,91 @@
+"""
+Compare the serializer list path with the .values() fast path, rendering
+included, for a page of books and a page of loans:
+
+    python benchmarks/list_serializers.py --page-size 100
+
+Runs against a scratch SQLite database, and checks that both paths render
+the same bytes before timing them.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_sytem_api.settings')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=500, help='Timed runs per path.')
+    return parser.parse_args()
+
+
+def setup():
+    import django
+    from django.conf import settings
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}}
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def seed(args):
+    from Library.models import Book, Transactions, User
+
+    user = User.objects.create_user(email='bench@example.com', username='bench', password='!')
+    Book.objects.bulk_create(
+        [Book(Title=f'Title {n}', Author=f'Author {n % 50}', ISBN=f'bench-{n}', Number_of_copies_Available=5) for n in range(args.books)],
+        batch_size=1000,
+    )
+    Transactions.objects.bulk_create(
+        [Transactions(user=user, book_id=book_id) for book_id in Book.objects.values_list('id', flat=True)],
+        batch_size=1000,
+    )
+
+
+def timed(build, repeat):
+    build()  # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        build()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    args = parse_args()
+    setup()
+    seed(args)
+    from rest_framework.renderers import JSONRenderer
+
+    from Library.fastlist import FastJSONRenderer, to_representation, values_for
+    from Library.models import Book, Transactions
+    from Library.serializers import BookSerializer, TransactionSerializer
+
+    cases = {
+        'books': (Book.objects.order_by('Title', 'id'), BookSerializer),
+        'loans': (Transactions.objects.order_by('-checkout_date', '-id'), TransactionSerializer),
+    }
+    print(f'{args.page_size} rows per page, {args.repeat} runs\n')
+    for name, (queryset, serializer_class) in cases.items():
+        def slow():
+            return JSONRenderer().render(serializer_class(queryset[:args.page_size], many=True).data)
+
+        def fast():
+            rows = values_for(queryset, serializer_class)[:args.page_size]
+            return FastJSONRenderer().render(to_representation(rows, serializer_class))
+
+        assert slow() == fast(), f'{name}: the two paths render different bytes'
+        slow_ms, fast_ms = timed(slow, args.repeat), timed(fast, args.repeat)
+        print(f'{name:6} serializer {slow_ms:8.3f} ms   values() {fast_ms:8.3f} ms   ({slow_ms / fast_ms:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
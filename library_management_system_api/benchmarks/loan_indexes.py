@@ -0,0 +1,131 @@
+"""
+Query plans and timings for the active-loan lookups before and after
+migration 0014 (open-loan unique key and Transactions indexes).
+
+Runs against a scratch SQLite database by default:
+
+    python benchmarks/loan_indexes.py --loans 200000
+
+Pass --configured-db to use the DATABASES from settings instead, e.g. a
+scratch MySQL schema. The Library app is migrated back to 0013 and forward
+again, so never point it at a database you care about.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_sytem_api.settings')
+
+BEFORE = '0013_outboxemail'
+AFTER = '0014_open_loan_constraint_and_indexes'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--loans', type=int, default=100000)
+    parser.add_argument('--open-ratio', type=float, default=0.1, help='Share of loans not yet returned.')
+    parser.add_argument('--repeat', type=int, default=200, help='Timed runs per query.')
+    parser.add_argument('--configured-db', action='store_true')
+    return parser.parse_args()
+
+
+def setup(args):
+    import django
+    from django.conf import settings
+
+    if not args.configured_db:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3')
+        settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}}
+    django.setup()
+
+
+def seed(args):
+    from django.utils import timezone
+    from Library.models import Book, Transactions, User
+
+    rng = random.Random(42)
+    today = timezone.now().date()
+    User.objects.bulk_create(
+        [User(email=f'bench{n}@example.com', username=f'bench{n}', password='!') for n in range(args.users)],
+        batch_size=1000,
+    )
+    Book.objects.bulk_create(
+        [Book(Title=f'Title {n}', Author=f'Author {n % 500}', ISBN=f'bench-{n}', Number_of_copies_Available=5) for n in range(args.books)],
+        batch_size=1000,
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    book_ids = list(Book.objects.values_list('id', flat=True))
+
+    # Distinct (user, book) pairs, so the data is valid under the old unique_together too.
+    pairs = set()
+    while len(pairs) < min(args.loans, len(user_ids) * len(book_ids)):
+        pairs.add((rng.choice(user_ids), rng.choice(book_ids)))
+    loans = []
+    for user_id, book_id in pairs:
+        checkout = today - timedelta(days=rng.randint(0, 3 * 365))
+        returned = rng.random() >= args.open_ratio
+        loans.append(Transactions(
+            user_id=user_id, book_id=book_id,
+            due_date=checkout + timedelta(days=14),
+            return_date=checkout + timedelta(days=rng.randint(1, 30)) if returned else None,
+        ))
+    Transactions.objects.bulk_create(loans, batch_size=2000)
+
+    open_loan = Transactions.objects.filter(return_date__isnull=True).values('user_id', 'book_id').first()
+    return open_loan['user_id'], open_loan['book_id'], today
+
+
+def queries(user_id, book_id, today):
+    from Library.models import Transactions
+
+    return {
+        'open loan for (user, book)': lambda: Transactions.objects.filter(user_id=user_id, book_id=book_id, return_date__isnull=True),
+        'open loans for user': lambda: Transactions.objects.filter(user_id=user_id, return_date__isnull=True),
+        'open loans for book': lambda: Transactions.objects.filter(book_id=book_id, return_date__isnull=True),
+        'overdue report': lambda: Transactions.objects.filter(due_date__lt=today, return_date__isnull=True).order_by('due_date')[:100],
+    }
+
+
+def measure(label, args, user_id, book_id, today):
+    print(f'\n=== {label} ===')
+    results = {}
+    for name, build in queries(user_id, book_id, today).items():
+        plan = build().explain()
+        list(build())  # warm up
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            list(build())
+        results[name] = (time.perf_counter() - started) / args.repeat * 1000
+        print(f'\n{name}: {results[name]:.3f} ms/query')
+        print('  ' + plan.replace('\n', '\n  '))
+    return results
+
+
+def main():
+    args = parse_args()
+    setup(args)
+    from django.core.management import call_command
+
+    call_command('migrate', 'Library', BEFORE, verbosity=0)
+    print(f'Seeding {args.users} users, {args.books} books, {args.loans} loans...')
+    user_id, book_id, today = seed(args)
+
+    before = measure(f'before ({BEFORE})', args, user_id, book_id, today)
+    call_command('migrate', 'Library', AFTER, verbosity=0)
+    after = measure(f'after ({AFTER})', args, user_id, book_id, today)
+
+    print('\n=== summary (ms/query) ===')
+    for name in before:
+        print(f'{name:32} {before[name]:9.3f} -> {after[name]:9.3f}  ({before[name] / after[name]:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,9 @@
 ASGI config for library_management_sytem_api project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it (e.g. ``uvicorn library_management_sytem_api.asgi:application``) for
+the server-sent events on /books/availability/stream/, which hold a connection
+open per client without holding a thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
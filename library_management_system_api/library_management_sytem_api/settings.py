@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Library.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Library.replicas.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'library_management_sytem_api.urls'
@@ -92,6 +94,15 @@ DATABASES = {
     }
 }
 
+# Read replicas are extra DATABASES aliases listed in LIBRARY_READ_REPLICAS,
+# each with 'TEST': {'MIRROR': 'default'}. Views marked read_from_replica send
+# their safe reads there, except for users who wrote something in the last
+# LIBRARY_REPLICA_PIN_SECONDS, who stay on the primary to read their writes.
+DATABASE_ROUTERS = ['Library.replicas.ReplicaRouter']
+LIBRARY_READ_REPLICAS = []
+LIBRARY_REPLICA_PIN_SECONDS = 5
+LIBRARY_REPLICA_PIN_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -138,8 +149,11 @@ AUTH_USER_MODEL = 'Library.User'
 REST_FRAMEWORK = {
     
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'Library.authentication.ClaimsJWTAuthentication',
     ),
+    # Reverse proxies in front of the app that append to X-Forwarded-For.
+    # Throttles key on REMOTE_ADDR while this is 0; behind one proxy set 1.
+    'NUM_PROXIES': 0,
 }
 
 from datetime import timedelta
@@ -161,6 +175,82 @@ SIMPLE_JWT = {
 
 APPEND_SLASH = False
 
+# Penalty charged per overdue day, capped at 999.99 per loan. Returns, the
+# compute_penalties job and the dashboard's outstanding total all use it.
+LIBRARY_PENALTY_PER_DAY = '1.00'
+
+# Full-text search backend for BookView's ?search=. None picks one from the
+# database vendor: MySQL FULLTEXT, SQLite FTS5, or plain icontains filters.
+LIBRARY_SEARCH_BACKEND = None
+# MySQL's innodb_ft_min_token_size. Search terms with shorter words are
+# matched with icontains, since the FULLTEXT index doesn't hold them.
+LIBRARY_SEARCH_MIN_TOKEN_SIZE = 3
+
+# Fail views that run more queries than their @declare_query_budget allows.
+LIBRARY_ENFORCE_QUERY_BUDGETS = False
+
+# Cache alias and timeout (seconds) for BookView list/retrieve responses.
+# Use a shared backend such as Redis or Memcached in production so every
+# worker sees the same catalog version.
+LIBRARY_CATALOG_CACHE = 'default'
+LIBRARY_CATALOG_CACHE_TIMEOUT = 300
+
+# Read-only API requests trust the user claims in an access token for this
+# many seconds after they were read from the database; writes and HTML pages
+# load the user's id, flags and session hash, cached for
+# LIBRARY_JWT_USER_CACHE_TTL seconds (0 disables the cache). Saving a user
+# drops the entry, so deactivation and password changes apply to those at
+# once; read-only API requests follow within LIBRARY_JWT_CLAIMS_MAX_AGE.
+LIBRARY_JWT_CLAIMS_MAX_AGE = 300
+LIBRARY_JWT_USER_CACHE = 'default'
+LIBRARY_JWT_USER_CACHE_TTL = 30
+
+# Request histograms served on /metrics. Under gunicorn (several worker
+# processes) point this at a directory shared by the workers and emptied
+# before they start; each worker then writes its totals there every
+# LIBRARY_METRICS_FLUSH_INTERVAL seconds and /metrics sums them.
+LIBRARY_METRICS_MULTIPROCESS_DIR = None
+LIBRARY_METRICS_FLUSH_INTERVAL = 5
+
+# Build list responses for books, loans and borrowing history from .values()
+# rows instead of serializer instances (same output). Installing orjson also
+# speeds up their JSON encoding.
+LIBRARY_FAST_LISTS = True
+
+# Fan-out for GET /books/availability/stream/. The in-process broker only
+# reaches streams held by the process that handled the checkout; with several
+# workers use 'Library.availability.CacheBroker' and a shared cache.
+LIBRARY_AVAILABILITY_BROKER = 'Library.availability.InProcessBroker'
+LIBRARY_AVAILABILITY_CACHE = 'default'
+LIBRARY_AVAILABILITY_POLL_INTERVAL = 0.5
+
+# Token buckets for the routes that hash passwords (JWT token, HTML login,
+# registration) and for loan writes, per client IP and per user (the account
+# being logged into, or the borrower), as 'requests/period' such as '30/m' or
+# '5/10s'. Over-limit requests get a 429 before any password or database
+# work. The buckets need a cache shared by every worker with atomic incr
+# (Redis, Memcached); allowed/throttled counts are served on /metrics.
+LIBRARY_THROTTLE_CACHE = 'default'
+LIBRARY_THROTTLE_RATES = {
+    'login': {'ip': '30/m', 'user': '10/m'},
+    'register': {'ip': '20/h'},
+    'checkout': {'ip': '300/m', 'user': '60/m'},
+}
+
+# Loan writes sent with an Idempotency-Key header store their first response
+# here for LIBRARY_IDEMPOTENCY_TTL seconds and replay it to retries with the
+# same key. A retry that arrives while the first request is still running
+# waits up to LIBRARY_IDEMPOTENCY_WAIT seconds for its response. Use a cache
+# shared by every worker (Redis, Memcached) so retries to another worker match.
+LIBRARY_IDEMPOTENCY_CACHE = 'default'
+LIBRARY_IDEMPOTENCY_TTL = 86400
+LIBRARY_IDEMPOTENCY_WAIT = 5
+
+# archive_loans moves loans returned more than this many days ago out of
+# Transactions into the archive table. Borrowing history pages and loan
+# exports read both tables.
+LIBRARY_ARCHIVE_AFTER_DAYS = 365
+
 # filepath: /C:/Users/HP/Desktop/library_management_sytem_api/library_management_sytem_api/settings.py
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.example.com'
@@ -171,5 +261,16 @@ EMAIL_HOST_PASSWORD = '@147896ABabc'
 DEFAULT_FROM_EMAIL = 'Library Management System <noreply@example.com>'
 
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
-]
\ No newline at end of file
+    'Library.authentication.CachedModelBackend',
+]
+
+# HTML sessions are read from the cache and written through to the database,
+# so losing the cache only costs a re-read; requests that leave the session
+# unchanged don't write it at all. With several workers SESSION_CACHE_ALIAS
+# must name a shared cache (Redis, Memcached), or a logout handled by one
+# worker would not reach the others. Flash messages travel in a signed
+# cookie rather than the session.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+SESSION_SAVE_EVERY_REQUEST = False
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
\ No newline at end of file